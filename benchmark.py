@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+
+from concurrent.futures import ProcessPoolExecutor
+
+from db_ops import DatabaseOperations
+from document_workers import bounded_map, build_csv_rows, segment_content
+from mock_services import MockReadService, MockChatService, synthetic_read_result, synthetic_sections
+from read_docs import AzureReadService
+from token_counter import get_token_counter
+from transport import create_session
+
+
+def _timed(fn, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+    }
+
+
+def bench_http(args):
+    payload = b'0' * args.payload_bytes
+    with MockReadService(latency=args.latency) as service:
+        url = service.url + '/vision/v3.2/read/analyze'
+        unpooled = _timed(lambda: requests.post(url, data=payload), args.requests)
+        session = create_session()
+        pooled = _timed(lambda: session.post(url, data=payload), args.requests)
+
+    unpooled, pooled = _summary(unpooled), _summary(pooled)
+    print(f"unpooled: {unpooled}")
+    print(f"pooled:   {pooled}")
+    print(f"saved per request: {unpooled['mean_ms'] - pooled['mean_ms']:.3f} ms")
+
+
+def bench_tokens(args):
+    sections = synthetic_sections(args.notices)
+    try:
+        reference = get_token_counter('tiktoken')
+    except Exception as e:
+        reference = None
+        print(f"tiktoken unavailable ({type(e).__name__}), batch fill accuracy is not reported")
+
+    for backend in args.backends:
+        try:
+            counter = get_token_counter(backend)
+        except Exception as e:
+            print(f"{backend}: unavailable ({type(e).__name__})")
+            continue
+        start = time.perf_counter()
+        batches = AzureReadService.batch_sections_by_tokens(sections, max_tokens=args.max_tokens, token_counter=counter)
+        elapsed = time.perf_counter() - start
+        result = {
+            'notices_per_s': round(len(sections) / elapsed, 1),
+            'batches': len(batches),
+            'notices_batched': sum(len(batch) for batch in batches),
+        }
+        if reference is not None:
+            # Fill as the model's tokenizer sees it: how close each batch gets to max_tokens
+            fills = [
+                sum(reference.count(name + " " + str(details)) for name, details in batch.items()) / args.max_tokens
+                for batch in batches
+            ]
+            result['mean_fill'] = round(statistics.mean(fills), 3)
+            result['overfull_batches'] = sum(1 for fill in fills if fill > 1)
+        print(f"{backend}: {result}")
+
+
+def bench_db(args):
+    db = DatabaseOperations(args.db_url)
+    db.init_db()
+    doc_id = db.insert_full_text(uuid.uuid4(), '{}', 'benchmark')
+    rows = [
+        {
+            'full_text_id': doc_id,
+            'section_content': "content",
+            'filename': 'benchmark',
+            'page_number': row // 8 + 1,
+            'gazette_notice_number': str(row),
+            'name_of_holder': [f'Jane Doe {row}'],
+            'registration_number': [f'Nakuru/Block 1/{row}'],
+            'location': 'Nakuru'
+        }
+        for row in range(args.rows)
+    ]
+    try:
+        start = time.perf_counter()
+        for row in rows:
+            db.insert_section_text(row['full_text_id'], row['section_content'], row['filename'], row['page_number'],
+                                   row['gazette_notice_number'], row['name_of_holder'],
+                                   row['registration_number'], row['location'])
+        per_row = time.perf_counter() - start
+
+        start = time.perf_counter()
+        db.insert_section_texts(rows)
+        bulk = time.perf_counter() - start
+
+        print(f"per-row: {args.rows / per_row:.1f} rows/s")
+        print(f"bulk:    {args.rows / bulk:.1f} rows/s")
+    finally:
+        db.delete_documents([doc_id])
+
+
+def _segment_and_build_rows(content):
+    # Everything a worker does for one document: parse, segment and prepare CSV rows
+    sections = segment_content(content)
+    return len(build_csv_rows(
+        ('benchmark', name, [name], [details['page_number']], 'Nakuru') for name, details in sections
+    ))
+
+
+def bench_workers(args):
+    contents = [json.dumps(synthetic_read_result(pages=args.pages, first_notice=index * 1000))
+                for index in range(args.documents)]
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        start = time.perf_counter()
+        if workers == 1:
+            list(map(_segment_and_build_rows, contents))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(bounded_map(pool, _segment_and_build_rows, contents, prefetch=workers * 2))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"workers={workers}: {args.documents / elapsed:.1f} documents/s, speedup {baseline / elapsed:.2f}x")
+
+
+def _run_command(command, env, log_path):
+    # Runs one main.py command and returns its wall time, exit code and peak RSS from the kernel's rusage.
+    # It runs from the repository, where the csv command expects sample_submission.csv.
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(log_path, mode='w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(repo_dir, 'main.py')] + command, env=env,
+                                   cwd=repo_dir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+    return elapsed, process.returncode, rusage.ru_maxrss / 1024
+
+
+def _stage_summary(metrics_path):
+    latencies = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding='utf-8') as f:
+            for line in f:
+                event = json.loads(line)
+                latencies.setdefault(event['stage'], []).append(event['seconds'])
+    return {stage: dict(calls=len(seconds), **_summary(seconds)) for stage, seconds in sorted(latencies.items())}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _bench_corpus(args, documents, read_service, chat_service):
+    work_dir = tempfile.mkdtemp(prefix='gazette-bench-')
+    pdf_dir = os.path.join(work_dir, 'pdfs')
+    os.makedirs(pdf_dir)
+    run_id = uuid.uuid4().hex[:8]
+    for index in range(documents):
+        # The mock ignores the upload, the bytes only need to differ so no document is deduplicated
+        with open(os.path.join(pdf_dir, f'bench-{run_id}-{index:04d}.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4\n% ' + uuid.uuid4().bytes.hex().encode() + b'\n%%EOF\n')
+
+    env = dict(os.environ, DB_URL=args.db_url, COGNITIVE_SERVICES_KEY='benchmark',
+               COGNITIVE_SERVICES_ENDPOINT=read_service.url, AZURE_OPENAI_KEY='benchmark',
+               AZURE_OPENAI_ENDPOINT=chat_service.url, MODEL=args.model)
+    extract_flags = ['--workers', str(args.workers), '--llm-concurrency', str(args.llm_concurrency), '--no-cache']
+    if not args.rules:
+        extract_flags.append('--no-rules')  # Synthetic notices are all standard ones the rules would take
+
+    result = {'documents': documents, 'pages_per_document': args.pages, 'commands': {}}
+    doc_ids = []
+    try:
+        for name in ('read', 'extract', 'csv'):
+            if name == 'read':
+                command = ['read-batch', pdf_dir, '--force', '--concurrency', str(args.concurrency)]
+            elif name == 'extract':
+                command = ['extract'] + doc_ids + extract_flags
+            else:
+                command = ['csv'] + doc_ids + ['--output', os.path.join(work_dir, 'sections.csv')]
+            if name != 'read' and not doc_ids:
+                break
+            metrics_path = os.path.join(work_dir, f'{name}.jsonl')
+            log_path = os.path.join(work_dir, f'{name}.log')
+            elapsed, exit_code, peak_rss_mb = _run_command(['--metrics', metrics_path] + command, env, log_path)
+            if name == 'read':
+                with open(log_path, encoding='utf-8') as f:
+                    doc_ids = re.findall(r'^\S+\.pdf: ([0-9a-f-]{36})$', f.read(), flags=re.MULTILINE)
+            result['commands'][name] = {
+                'exit_code': exit_code,
+                'wall_seconds': round(elapsed, 3),
+                'documents_per_second': round(documents / elapsed, 3),
+                'peak_rss_mb': round(peak_rss_mb, 1),
+                'stages': _stage_summary(metrics_path)
+            }
+            print(f"{documents} documents, {name}: {elapsed:.2f}s, exit code {exit_code}, log in {log_path}",
+                  file=sys.stderr)
+    finally:
+        # Leave the scratch database as it was, the next corpus size starts from empty tables too
+        DatabaseOperations(args.db_url).delete_documents(doc_ids)
+    result['documents_read'] = len(doc_ids)
+    return result
+
+
+def bench_e2e(args):
+    DatabaseOperations(args.db_url).init_db()
+    read_service = MockReadService(latency=args.read_latency, polls_until_done=args.polls_until_done,
+                                   requests_per_minute=args.read_rpm,
+                                   result_factory=lambda operation_id: synthetic_read_result(
+                                       pages=args.pages, first_notice=operation_id * 1000 + 1))
+    chat_service = MockChatService(latency=args.llm_latency, requests_per_minute=args.llm_rpm,
+                                   invalid_every=args.invalid_every)
+    with read_service, chat_service:
+        results = [_bench_corpus(args, documents, read_service, chat_service) for documents in args.documents]
+        report = {
+            'commit': _git_commit(),
+            'timestamp': round(time.time(), 3),
+            'settings': {name: value for name, value in vars(args).items() if name not in ('command', 'db_url')},
+            'results': results,
+            'mock_requests': {'read_throttled': read_service.throttled, 'llm_throttled': chat_service.throttled,
+                              'llm_completions': next(chat_service.completion_ids)}
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks against local stand-ins of the Azure services.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    http_parser = subparsers.add_parser('http', help='Per-request latency with and without the pooled session')
+    http_parser.add_argument('--requests', type=int, default=500, help='Number of requests per mode')
+    http_parser.add_argument('--payload-bytes', type=int, default=1024, help='Size of the uploaded body')
+    http_parser.add_argument('--latency', type=float, default=0.0, help='Simulated server latency in seconds')
+
+    tokens_parser = subparsers.add_parser('tokens', help='Batching throughput and fill per token counter backend')
+    tokens_parser.add_argument('--notices', type=int, default=2000, help='Number of synthetic gazette notices')
+    tokens_parser.add_argument('--max-tokens', type=int, default=2500, help='Token budget per batch')
+    tokens_parser.add_argument('--backends', nargs='+', default=['nltk', 'regex', 'tiktoken'],
+                               help='Token counter backends to compare')
+
+    db_parser = subparsers.add_parser('db', help='Per-row versus bulk section inserts')
+    db_parser.add_argument('--rows', type=int, default=2000, help='Number of sections to insert per mode')
+    db_parser.add_argument('--db-url', type=str, required=True,
+                           help='Scratch database to benchmark against, it is migrated with init_db')
+
+    workers_parser = subparsers.add_parser('workers', help='Segmentation and row building scaling over 1..N processes')
+    workers_parser.add_argument('--documents', type=int, default=64, help='Number of synthetic documents')
+    workers_parser.add_argument('--pages', type=int, default=100, help='Pages per synthetic document')
+    workers_parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='Largest pool size to try')
+
+    e2e_parser = subparsers.add_parser('e2e', help='Run main.py read, extract and csv over synthetic corpora against '
+                                                    'mock Read and chat completions endpoints, report JSON')
+    e2e_parser.add_argument('--documents', type=int, nargs='+', default=[1, 10, 100],
+                            help='Corpus sizes to run, e.g. 1 10 100 1000')
+    e2e_parser.add_argument('--pages', type=int, default=3, help='Pages per synthetic document, four notices each')
+    e2e_parser.add_argument('--read-latency', type=float, default=0.0, help='Mock Read latency per request in seconds')
+    e2e_parser.add_argument('--polls-until-done', type=int, default=1, help='Polls before a mock Read operation ends')
+    e2e_parser.add_argument('--read-rpm', type=int, default=None, help='Mock Read requests per minute before 429s')
+    e2e_parser.add_argument('--llm-latency', type=float, default=0.0, help='Mock chat completion latency in seconds')
+    e2e_parser.add_argument('--llm-rpm', type=int, default=None, help='Mock chat requests per minute before 429s')
+    e2e_parser.add_argument('--invalid-every', type=int, default=0,
+                            help='Make every Nth mock chat completion unparseable')
+    e2e_parser.add_argument('--concurrency', type=int, default=8, help='read-batch --concurrency')
+    e2e_parser.add_argument('--workers', type=int, default=1, help='extract --workers')
+    e2e_parser.add_argument('--llm-concurrency', type=int, default=1, help='extract --llm-concurrency')
+    e2e_parser.add_argument('--rules', action='store_true',
+                            help='Let rule extraction take standard notices instead of sending all of them to the LLM')
+    e2e_parser.add_argument('--model', type=str, default='gpt-35-turbo', help='Deployment name sent to the mock')
+    e2e_parser.add_argument('--output', type=str, default=None, help='Also write the JSON report to this file')
+    e2e_parser.add_argument('--db-url', type=str, required=True,
+                            help='Scratch database the commands write to, it is migrated with init_db')
+
+    args = parser.parse_args()
+    if args.command in ('db', 'e2e') and args.db_url == os.getenv('DB_URL'):
+        parser.error('--db-url must be a scratch database, not the DB_URL the application uses')
+
+    if args.command == 'http':
+        bench_http(args)
+    elif args.command == 'tokens':
+        bench_tokens(args)
+    elif args.command == 'db':
+        bench_db(args)
+    elif args.command == 'workers':
+        bench_workers(args)
+    elif args.command == 'e2e':
+        bench_e2e(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
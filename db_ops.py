@@ -1,17 +1,41 @@
 # db_operations.py
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, ARRAY
+from sqlalchemy import insert, text, func, case, create_engine, Column, Integer, String, Text, ForeignKey, DateTime, \
+    Index
+from sqlalchemy.exc import IntegrityError, DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from dotenv import load_dotenv
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY, insert as pg_insert
 import uuid
+from datetime import datetime, timedelta
 
 import os
 
+from metrics import timed
+
 load_dotenv()
 db_password = os.getenv('DB_PASSWORD')
 Base = declarative_base()
 
+# array_to_string is only STABLE, so the holder names get an IMMUTABLE wrapper that an index can use
+HOLDER_NAMES_FUNCTION = ("CREATE OR REPLACE FUNCTION gazette_holder_names(text[]) RETURNS text "
+                         "AS $$ SELECT array_to_string($1, ' ') $$ LANGUAGE sql IMMUTABLE")
+# Columns added to tables that already exist, which create_all leaves alone
+ADDED_COLUMNS = [
+    'ALTER TABLE section_texts ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)',
+]
+# Rows written before holders and title numbers were stored one per array element
+SPLIT_ARRAYS = [
+    f"UPDATE section_texts SET {column} = ARRAY(SELECT btrim(part) FROM unnest(string_to_array({column}[1], ',')) "
+    f"AS part WHERE btrim(part) <> '') WHERE cardinality({column}) = 1 AND {column}[1] LIKE '%,%'"
+    for column in ('name_of_holder', 'registration_number')
+]
+TRIGRAM_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_section_texts_holder_names_trgm ON section_texts '
+    'USING gin (gazette_holder_names(name_of_holder) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_section_texts_location_trgm ON section_texts USING gin (location gin_trgm_ops)',
+]
+
 
 class FullText(Base):
     __tablename__ = 'full_texts'
@@ -19,12 +43,19 @@ class FullText(Base):
     content = Column(Text)
     name = Column(Text)
     section_texts = relationship("SectionText", back_populates="full_text")
+    pages = relationship("FullTextPage", back_populates="full_text", order_by="FullTextPage.page_number")
 
 
 class SectionText(Base):
     __tablename__ = 'section_texts'
+    __table_args__ = (
+        # One row per notice, which also makes re-inserting an extraction an upsert
+        Index('uq_section_texts_filename_notice', 'filename', 'gazette_notice_number', unique=True),
+        Index('ix_section_texts_name_of_holder', 'name_of_holder', postgresql_using='gin'),
+        Index('ix_section_texts_registration_number', 'registration_number', postgresql_using='gin'),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'))
+    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'), index=True)
     section_content = Column(Text)
     filename = Column(String(255))
     page_number = Column(Integer)
@@ -32,51 +63,326 @@ class SectionText(Base):
     name_of_holder = Column(ARRAY(String))
     registration_number = Column(ARRAY(String))
     location = Column(String(255))
+    # Hash of the normalized notice text the row was extracted from, see segmentation.notice_hash
+    content_hash = Column(String(64))
     full_text = relationship("FullText", back_populates="section_texts")
 
 
+class NonLandNotice(Base):
+    # Notices the LLM answered without land metadata, so incremental extraction does not send them again
+    __tablename__ = 'non_land_notices'
+    filename = Column(String(255), primary_key=True)
+    gazette_notice_number = Column(String(255), primary_key=True)
+    content_hash = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DocumentHash(Base):
+    # SHA-256 of the source PDF, so re-ingesting the same file reuses its FullText instead of paying for OCR again
+    __tablename__ = 'document_hashes'
+    content_hash = Column(String(64), primary_key=True)
+    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'))
+
+
+class FullTextPage(Base):
+    # One Read API readResults entry per row, stored as JSONB so pages load lazily and lines can be queried in SQL
+    __tablename__ = 'full_text_pages'
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'), index=True)
+    page_number = Column(Integer)
+    page = Column(JSONB)
+    full_text = relationship("FullText", back_populates="pages")
+
+
+class PipelineDocument(Base):
+    # Progress of a file through the pipeline command: read -> extracted -> exported
+    __tablename__ = 'pipeline_documents'
+    filename = Column(String(255), primary_key=True)
+    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'))
+    status = Column(String(32))
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PipelineBatch(Base):
+    # LLM batches whose rows are already saved, so a crashed extraction resumes after the last one
+    __tablename__ = 'pipeline_batches'
+    full_text_id = Column(UUID(as_uuid=True), ForeignKey('full_texts.id'), primary_key=True)
+    batch_key = Column(String(64), primary_key=True)
+    completed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LLMResponse(Base):
+    __tablename__ = 'llm_responses'
+    key = Column(String(64), primary_key=True)
+    model = Column(String(255))
+    response = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class DatabaseOperations:
     def __init__(self, database_url):
         self.engine = create_engine(database_url)
-        Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
 
-    def insert_full_text(self, doc_id, content, name):
+    def init_db(self):
+        # Creates any missing tables and indexes; run once through `main.py init-db` rather than on every start-up
+        Base.metadata.create_all(self.engine)
+        # create_all skips tables that already exist, so columns and indexes added since are created here
+        with self.engine.begin() as connection:
+            for statement in ADDED_COLUMNS + SPLIT_ARRAYS:
+                connection.execute(text(statement))
+        removed = self.delete_duplicate_sections()
+        if removed:
+            print(f'Removed {len(removed)} duplicate notices before adding the unique index:')
+            for filename, number, section_id in removed:
+                print(f'  {filename} {number}: {section_id}')
+        for index in SectionText.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        with self.engine.begin() as connection:
+            connection.execute(text(HOLDER_NAMES_FUNCTION))
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                for statement in TRIGRAM_INDEXES:
+                    connection.execute(text(statement))
+        except DBAPIError as e:
+            # Searches still work without pg_trgm, they just scan the table
+            print(f'Trigram indexes not created, name and location searches will be slower: {e.orig}')
+
+    def delete_duplicate_sections(self):
+        # Keeps the row with the most metadata filled in of every (filename, notice number), ties go to the
+        # lowest id so every run keeps the same one. Returns the deleted (filename, number, id) rows.
+        with self.engine.begin() as connection:
+            result = connection.execute(text(
+                'WITH ranked AS (SELECT id, row_number() OVER ('
+                'PARTITION BY filename, gazette_notice_number ORDER BY '
+                '(coalesce(cardinality(name_of_holder), 0) > 0)::int + '
+                '(coalesce(cardinality(registration_number), 0) > 0)::int + '
+                '(location IS NOT NULL)::int + (page_number IS NOT NULL)::int DESC, id) AS rank '
+                'FROM section_texts WHERE filename IS NOT NULL AND gazette_notice_number IS NOT NULL) '
+                'DELETE FROM section_texts USING ranked WHERE section_texts.id = ranked.id AND ranked.rank > 1 '
+                'RETURNING section_texts.filename, section_texts.gazette_notice_number, section_texts.id'
+            ))
+            return sorted(tuple(row) for row in result)
+
+    @staticmethod
+    def section_upsert():
+        statement = pg_insert(SectionText)
+        return statement.on_conflict_do_update(
+            index_elements=[SectionText.filename, SectionText.gazette_notice_number],
+            set_={column: statement.excluded[column] for column in (
+                'full_text_id', 'section_content', 'page_number', 'name_of_holder', 'registration_number',
+                'location', 'content_hash')}
+        )
+
+    @timed('db.insert_full_text')
+    def insert_full_text(self, doc_id, content, name, pages=None, content_hash=None):
         session = self.Session()
         full_text = FullText(id=doc_id, content=content, name=name)
         session.add(full_text)
+        session.flush()
+        if content_hash is not None:
+            session.merge(DocumentHash(content_hash=content_hash, full_text_id=doc_id))
+        if pages is not None:
+            session.execute(insert(FullTextPage), [
+                {'full_text_id': doc_id, 'page_number': page_number, 'page': page}
+                for page_number, page in enumerate(pages, start=1)
+            ])
         session.commit()
         session.refresh(full_text)
         session.close()
         return full_text.id
 
+    @timed('db.insert_section_text')
     def insert_section_text(self, full_text_id, section_content, filename, page_number, gazette_notice_number,
                             name_of_holder, registration_number, location):
         session = self.Session()
-        section_text = SectionText(
-            full_text_id=full_text_id,
-            section_content=section_content,
-            filename=filename,
-            page_number=page_number,
-            gazette_notice_number=gazette_notice_number,
-            name_of_holder=name_of_holder,
-            registration_number=registration_number,
-            location=location
-        )
-        session.add(section_text)
+        session.execute(self.section_upsert(), [{
+            'full_text_id': full_text_id,
+            'section_content': section_content,
+            'filename': filename,
+            'page_number': page_number,
+            'gazette_notice_number': gazette_notice_number,
+            'name_of_holder': name_of_holder,
+            'registration_number': registration_number,
+            'location': location
+        }])
         session.commit()
         session.close()
 
+    @timed('db.insert_section_texts')
+    def insert_section_texts(self, rows, full_text_id=None, batch_keys=None, non_land_notices=None):
+        # All rows go in as one upsert inside a single transaction. Rows already stored for the same
+        # (filename, notice number) are updated, so re-running an extraction never duplicates them.
+        # The given batch_keys are checkpointed and the non_land_notices recorded in that same transaction.
+        if not rows and not batch_keys and not non_land_notices:
+            return 0
+        # A single INSERT .. ON CONFLICT cannot touch the same row twice, so the last row of a notice wins
+        unique_rows = {}
+        for row in rows:
+            key = (row['filename'], row['gazette_notice_number'])
+            unique_rows[key if key[1] is not None else id(row)] = row
+        with self.Session.begin() as session:
+            if unique_rows:
+                session.execute(self.section_upsert(), list(unique_rows.values()))
+            if non_land_notices:
+                statement = pg_insert(NonLandNotice)
+                session.execute(statement.on_conflict_do_update(
+                    index_elements=[NonLandNotice.filename, NonLandNotice.gazette_notice_number],
+                    set_={'content_hash': statement.excluded.content_hash, 'created_at': datetime.utcnow()}
+                ), non_land_notices)
+            for batch_key in batch_keys or []:
+                session.merge(PipelineBatch(full_text_id=full_text_id, batch_key=batch_key))
+        return len(rows)
+
+    @timed('db.get_completed_batch_keys')
+    def get_completed_batch_keys(self, full_text_id):
+        session = self.Session()
+        keys = {key for (key,) in session.query(PipelineBatch.batch_key)
+                .filter(PipelineBatch.full_text_id == full_text_id)}
+        session.close()
+        return keys
+
+    def delete_documents(self, full_text_ids):
+        # Removes documents and everything derived from them, e.g. the rows a benchmark run wrote
+        with self.Session.begin() as session:
+            filenames = session.query(FullText.name).filter(FullText.id.in_(full_text_ids))
+            session.query(NonLandNotice).filter(NonLandNotice.filename.in_(filenames.scalar_subquery())) \
+                .delete(synchronize_session=False)
+            for model in (SectionText, FullTextPage, PipelineBatch, PipelineDocument, DocumentHash):
+                session.query(model).filter(model.full_text_id.in_(full_text_ids)).delete(synchronize_session=False)
+            return session.query(FullText).filter(FullText.id.in_(full_text_ids)).delete(synchronize_session=False)
+
+    @timed('db.get_pipeline_document')
+    def get_pipeline_document(self, filename):
+        session = self.Session()
+        document = session.query(PipelineDocument).filter(PipelineDocument.filename == filename).first()
+        session.close()
+        return document
+
+    @timed('db.set_pipeline_document')
+    def set_pipeline_document(self, filename, full_text_id, status):
+        with self.Session.begin() as session:
+            session.merge(PipelineDocument(filename=filename, full_text_id=full_text_id, status=status,
+                                           updated_at=datetime.utcnow()))
+
+    @timed('db.get_full_text_id_by_hash')
+    def get_full_text_id_by_hash(self, content_hash):
+        session = self.Session()
+        document_hash = session.query(DocumentHash).filter(DocumentHash.content_hash == content_hash).first()
+        session.close()
+        return document_hash.full_text_id if document_hash else None
+
+    @timed('db.get_full_text_by_id')
     def get_full_text_by_id(self, doc_id):
         session = self.Session()
         full_text = session.query(FullText).filter(FullText.id == doc_id).first()
         session.close()
         return full_text
 
+    @timed('db.iter_full_text_pages')
+    def iter_full_text_pages(self, full_text_id, batch_size=20):
+        # Streams pages through a server-side cursor instead of loading the whole analysis
+        session = self.Session()
+        try:
+            query = session.query(FullTextPage.page) \
+                .filter(FullTextPage.full_text_id == full_text_id) \
+                .order_by(FullTextPage.page_number) \
+                .yield_per(batch_size)
+            for (page,) in query:
+                yield page
+        finally:
+            session.close()
+
+    @timed('db.get_sections_by_doc_id')
     def get_sections_by_doc_id(self, doc_id):
         session = self.Session()
         sections = session.query(SectionText).filter(SectionText.full_text_id == doc_id).all()
         session.close()
         return sections
 
+    @timed('db.get_section_hashes')
+    def get_section_hashes(self, filename):
+        # Notice number -> hashes of the texts it was already extracted from, with or without land metadata
+        session = self.Session()
+        hashes = {}
+        for model in (SectionText, NonLandNotice):
+            for number, content_hash in session.query(model.gazette_notice_number, model.content_hash) \
+                    .filter(model.filename == filename):
+                hashes.setdefault(number, set()).add(content_hash)
+        session.close()
+        return hashes
+
+    @timed('db.find_sections')
+    def find_sections(self, holder_name=None, title_number=None, location=None, exact=False, limit=100):
+        # Names and locations are matched case-insensitively as substrings through the trigram indexes,
+        # title numbers and exact names through the GIN indexes on the arrays
+        session = self.Session()
+        query = session.query(SectionText)
+        if holder_name is not None:
+            if exact:
+                query = query.filter(SectionText.name_of_holder.contains([holder_name]))
+            else:
+                query = query.filter(func.gazette_holder_names(SectionText.name_of_holder).ilike(f'%{holder_name}%'))
+        if title_number is not None:
+            query = query.filter(SectionText.registration_number.contains([title_number]))
+        if location is not None:
+            query = query.filter(SectionText.location.ilike(f'%{location}%'))
+        sections = query.order_by(SectionText.filename, SectionText.gazette_notice_number).limit(limit).all()
+        session.close()
+        return sections
+
+    @timed('db.get_llm_response')
+    def get_llm_response(self, key, ttl=None):
+        session = self.Session()
+        query = session.query(LLMResponse).filter(LLMResponse.key == key)
+        if ttl is not None:
+            query = query.filter(LLMResponse.created_at >= datetime.utcnow() - timedelta(seconds=ttl))
+        cached = query.first()
+        session.close()
+        return cached.response if cached else None
+
+    @timed('db.insert_llm_response')
+    def insert_llm_response(self, key, model, response):
+        session = self.Session()
+        try:
+            session.merge(LLMResponse(key=key, model=model, response=response, created_at=datetime.utcnow()))
+            session.commit()
+        except IntegrityError:
+            # Another worker cached the same batch first
+            session.rollback()
+        finally:
+            session.close()
 
+    @timed('db.delete_llm_responses')
+    def delete_llm_responses(self, older_than=None):
+        session = self.Session()
+        query = session.query(LLMResponse)
+        if older_than is not None:
+            query = query.filter(LLMResponse.created_at < datetime.utcnow() - timedelta(seconds=older_than))
+        deleted = query.delete(synchronize_session=False)
+        session.commit()
+        session.close()
+        return deleted
+
+    @timed('db.iter_section_rows')
+    def iter_section_rows(self, doc_ids, batch_size=1000):
+        # One query for all documents, only the exported columns, streamed through a server-side cursor.
+        # Rows come in the order of doc_ids, then by notice number, so every export is identical.
+        session = self.Session()
+        try:
+            document_order = case({doc_id: index for index, doc_id in enumerate(doc_ids)},
+                                  value=SectionText.full_text_id)
+            query = session.query(
+                SectionText.filename,
+                SectionText.gazette_notice_number,
+                SectionText.name_of_holder,
+                SectionText.registration_number,
+                SectionText.location
+            ).filter(SectionText.full_text_id.in_(doc_ids)) \
+                .order_by(document_order, SectionText.gazette_notice_number, SectionText.id) \
+                .yield_per(batch_size)
+            for row in query:
+                yield row
+        finally:
+            session.close()
@@ -0,0 +1,84 @@
+import json
+import os
+import re
+from collections import deque
+
+from dotenv import load_dotenv
+
+from segmentation import iter_sections
+
+# Pure CPU steps that can run in a process pool. They only exchange compact, picklable results with the parent.
+load_dotenv()
+_db = None
+
+
+def _worker_db():
+    # One connection pool per worker process, created on first use
+    global _db
+    if _db is None:
+        from db_ops import DatabaseOperations
+        _db = DatabaseOperations(os.getenv('DB_URL'))
+    return _db
+
+
+def bounded_map(pool, fn, iterable, prefetch):
+    # Like pool.map, but keeps at most `prefetch` tasks in flight so results never pile up in memory
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def segment_content(content):
+    return list(iter_sections(json.loads(content)['analyzeResult']['readResults']))
+
+
+def segment_full_text(full_text_id):
+    db = _worker_db()
+    full_text = db.get_full_text_by_id(full_text_id)
+    # The name goes back with the sections so the parent never loads the content blob again
+    if full_text.content is None:  # Stored page by page
+        return full_text_id, full_text.name, list(iter_sections(db.iter_full_text_pages(full_text_id)))
+    return full_text_id, full_text.name, segment_content(full_text.content)
+
+
+def preprocess_name(name):
+    try:
+        name = str(name)
+        # Convert to lowercase and remove extra whitespaces
+        name = re.sub(r'\s+', '', name.lower().strip())
+
+        # Handle names separated by comma
+        if ',' in name:
+            names = name.split(',')
+            names = [re.sub(r'[^a-zA-Z0-9\s/]', '', n) for n in names]
+            return ','.join(names)
+
+        # Remove special characters
+        name = re.sub(r'[^a-zA-Z0-9\s/]', '', name)
+        return name
+    except:
+        return name
+
+
+def build_csv_rows(section_rows):
+    # (filename, notice number, holders, registration numbers, location) tuples -> [id, pred] rows
+    csv_rows = []
+    for filename, notice_number, name_of_holder, registration_number, location in section_rows:
+        if '2022_VOL252' in filename:
+            filename = filename.replace('VOL252', '252')
+        prefix = f"{filename}_{notice_number}_"
+
+        if name_of_holder:
+            csv_rows.append([prefix + "name of the holder", preprocess_name(', '.join(name_of_holder))])
+
+        if registration_number:
+            csv_rows.append([prefix + "Registration numbers", preprocess_name(', '.join(registration_number))])
+
+        if location:
+            location = ', '.join(location) if isinstance(location, (list, tuple)) else location
+            csv_rows.append([prefix + "Land location", preprocess_name(location)])
+    return csv_rows
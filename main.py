@@ -1,6 +1,8 @@
 import argparse
 
 from read_docs import AzureReadService
+from pipeline import GazettePipeline
+from metrics import metrics
 from dotenv import load_dotenv
 import os
 
@@ -13,33 +15,158 @@ cognitive_services_endpoint = os.getenv('COGNITIVE_SERVICES_ENDPOINT')
 def main():
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description='Analyze a PDF document using Azure Read Service.')
+    parser.add_argument('--metrics', type=str, default=os.getenv('METRICS_PATH'),
+                        help='Append per-stage timing and cost events to this JSON lines file')
+    parser.add_argument('--prometheus', type=str, default=None,
+                        help='Write the metric totals in Prometheus text format to this file on exit')
     subparsers = parser.add_subparsers(dest='command')
 
+    subparsers.add_parser('init-db', help='Create the database tables')
+
     # Create a subparser for the read_document function
     read_parser = subparsers.add_parser('read', help='Read a PDF document and extract text')
     read_parser.add_argument('file_path', type=str, help='Path to the PDF file to be analyzed')
+    read_parser.add_argument('--force', action='store_true',
+                             help='Run OCR again even if this PDF was already read')
+    read_parser.add_argument('--text-layer', action='store_true',
+                             help='Use the embedded text of born-digital PDFs and only OCR pages without one')
+    read_parser.add_argument('--store-pages', action='store_true',
+                             help='Store the analysis as JSONB page rows instead of one text blob')
+
+    read_batch_parser = subparsers.add_parser('read-batch', help='Read all PDF documents in a directory or glob')
+    read_batch_parser.add_argument('path', type=str, help='Directory or glob pattern of the PDF files to be analyzed')
+    read_batch_parser.add_argument('--force', action='store_true',
+                                   help='Run OCR again even if this PDF was already read')
+    read_batch_parser.add_argument('--text-layer', action='store_true',
+                                   help='Use the embedded text of born-digital PDFs and only OCR pages without one')
+    read_batch_parser.add_argument('--concurrency', type=int, default=8,
+                                   help='Maximum number of documents being analyzed at the same time')
+    read_batch_parser.add_argument('--store-pages', action='store_true',
+                                   help='Store the analysis as JSONB page rows instead of one text blob')
+
+    pipeline_parser = subparsers.add_parser('pipeline',
+                                            help='Read, extract and export every PDF in a directory or glob, '
+                                                 'resuming from where an earlier run stopped')
+    pipeline_parser.add_argument('path', type=str, help='Directory or glob pattern of the PDF files to be processed')
+    pipeline_parser.add_argument('--force', action='store_true',
+                                 help='Run OCR again even if this PDF was already read')
+    pipeline_parser.add_argument('--text-layer', action='store_true',
+                                 help='Use the embedded text of born-digital PDFs and only OCR pages without one')
+    pipeline_parser.add_argument('--concurrency', type=int, default=8,
+                                 help='Maximum number of documents being analyzed at the same time')
+    pipeline_parser.add_argument('--llm-concurrency', type=int, default=1,
+                                 help='Number of metadata batches sent to Azure OpenAI in parallel')
+    pipeline_parser.add_argument('--output', type=str, default=None,
+                                 help='Where to write the CSV, defaults to ~/Downloads/sections_export.csv')
 
     # Create a subparser for another function (e.g., extract_sections)
     extract_parser = subparsers.add_parser('extract', help='Extract sections from an analyzed document')
-    extract_parser.add_argument('doc_id', type=str,
+    extract_parser.add_argument('doc_ids', type=str, nargs='+',
                                 help='The JSON result from the analysis to extract sections from')
+    extract_parser.add_argument('--workers', type=int, default=1,
+                                help='Segment several documents at once across this many processes')
+    extract_parser.add_argument('--llm-concurrency', type=int, default=1,
+                                help='Number of metadata batches sent to Azure OpenAI in parallel')
+    extract_parser.add_argument('--rpm', type=int, default=None, help='Requests per minute limit for Azure OpenAI')
+    extract_parser.add_argument('--tpm', type=int, default=None, help='Tokens per minute limit for Azure OpenAI')
+    extract_parser.add_argument('--token-counter', choices=['auto', 'tiktoken', 'regex', 'nltk'], default='auto',
+                                help='How batch sizes are measured; auto prefers the model tokenizer')
+    extract_parser.add_argument('--no-classifier', action='store_true',
+                                help='Send non-land notices to Azure OpenAI too instead of dropping them locally')
+    extract_parser.add_argument('--classifier-threshold', type=float, default=0.5,
+                                help='Minimum land probability for a notice to be kept')
+    extract_parser.add_argument('--classifier-audit', type=str, default='dropped_notices.jsonl',
+                                help='JSON lines file that records every dropped notice')
+    extract_parser.add_argument('--no-rules', action='store_true',
+                                help='Send every notice to Azure OpenAI instead of extracting standard land notices '
+                                     'with rules first')
+    extract_parser.add_argument('--rules-threshold', type=float, default=0.9,
+                                help='Minimum rule extraction confidence for a notice to skip the LLM')
+    extract_parser.add_argument('--no-cache', action='store_true',
+                                help='Always call Azure OpenAI instead of reusing cached responses')
+    extract_parser.add_argument('--incremental', action='store_true',
+                                help='Only extract notices that are new, whose text changed or whose earlier '
+                                     'extraction failed')
+
+    clear_cache_parser = subparsers.add_parser('clear-cache', help='Delete cached Azure OpenAI responses')
+    clear_cache_parser.add_argument('--older-than-days', type=float, default=None,
+                                    help='Only delete responses cached more than this many days ago')
+
+    search_parser = subparsers.add_parser('search', help='Look up extracted notices')
+    search_parser.add_argument('--holder', type=str, default=None, help='Name, or part of the name, of a holder')
+    search_parser.add_argument('--title', type=str, default=None, help='Title or registration number')
+    search_parser.add_argument('--location', type=str, default=None, help='Location, or part of it')
+    search_parser.add_argument('--exact', action='store_true', help='Only match holder names exactly')
+    search_parser.add_argument('--limit', type=int, default=100, help='Maximum number of notices returned')
 
     csv_parser = subparsers.add_parser('csv', help='Export sections to a CSV file')
     csv_parser.add_argument('doc_ids', type=str, nargs='+', help='List of document IDs to be exported to CSV')
+    csv_parser.add_argument('--output', type=str, default=None,
+                            help='Where to write the CSV, defaults to ~/Downloads/sections_export.csv')
+    csv_parser.add_argument('--workers', type=int, default=1,
+                            help='Build CSV rows across this many processes')
 
     args = parser.parse_args()
+    metrics.configure(jsonl_path=args.metrics)
 
-    azure_read_service = AzureReadService(cognitive_services_key, cognitive_services_endpoint)
+    azure_read_service = AzureReadService(
+        cognitive_services_key,
+        cognitive_services_endpoint,
+        llm_concurrency=getattr(args, 'llm_concurrency', 1),
+        requests_per_minute=getattr(args, 'rpm', None),
+        tokens_per_minute=getattr(args, 'tpm', None),
+        use_cache=not getattr(args, 'no_cache', False),
+        token_counter=getattr(args, 'token_counter', 'auto'),
+        store_pages=getattr(args, 'store_pages', False),
+        use_text_layer=getattr(args, 'text_layer', False),
+        force_read=getattr(args, 'force', False),
+        incremental=getattr(args, 'incremental', False),
+        use_rules=not getattr(args, 'no_rules', False),
+        rule_threshold=getattr(args, 'rules_threshold', 0.9),
+        use_classifier=not getattr(args, 'no_classifier', False),
+        classifier_threshold=getattr(args, 'classifier_threshold', 0.5),
+        classifier_audit_path=getattr(args, 'classifier_audit', 'dropped_notices.jsonl')
+    )
 
-    if args.command == 'read':
+    if args.command == 'init-db':
+        azure_read_service.db.init_db()
+        print('Database tables created')
+    elif args.command == 'read':
         azure_read_service.read_document(args.file_path)
+        print(f"{azure_read_service.ocr_calls_avoided} OCR calls avoided")
+    elif args.command == 'read-batch':
+        file_paths = azure_read_service.resolve_document_paths(args.path)
+        results = azure_read_service.read_documents(file_paths, max_concurrency=args.concurrency)
+        for file_path, full_text_id in results.items():
+            print(f"{file_path}: {full_text_id}")
+        print(f"{azure_read_service.ocr_calls_avoided} OCR calls avoided")
+    elif args.command == 'pipeline':
+        file_paths = azure_read_service.resolve_document_paths(args.path)
+        GazettePipeline(azure_read_service, output_path=args.output, max_concurrency=args.concurrency).run(file_paths)
     elif args.command == 'extract':
-        azure_read_service.extract_sections(args.doc_id)
+        if len(args.doc_ids) == 1 and args.workers == 1:
+            azure_read_service.extract_sections(args.doc_ids[0])
+        else:
+            azure_read_service.extract_documents(args.doc_ids, workers=args.workers)
+    elif args.command == 'clear-cache':
+        older_than = args.older_than_days * 24 * 3600 if args.older_than_days is not None else None
+        deleted = azure_read_service.db.delete_llm_responses(older_than)
+        print(f'Deleted {deleted} cached responses')
+    elif args.command == 'search':
+        sections = azure_read_service.db.find_sections(holder_name=args.holder, title_number=args.title,
+                                                       location=args.location, exact=args.exact, limit=args.limit)
+        for section in sections:
+            print(f"{section.filename} {section.gazette_notice_number}: {', '.join(section.name_of_holder or [])} | "
+                  f"{', '.join(section.registration_number or [])} | {section.location}")
+        print(f'{len(sections)} notices found')
     elif args.command == "csv":
-        azure_read_service.export_sections_to_csv(args.doc_ids)
+        azure_read_service.export_sections_to_csv(args.doc_ids, output_path=args.output, workers=args.workers)
     else:
         parser.print_help()
 
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    # Per-stage wall time and volume counters. Every event can be streamed as a JSON line,
+    # and the running totals dumped in Prometheus text format.
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def configure(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+
+    def record(self, stage, seconds=0.0, **fields):
+        event = {'ts': round(time.time(), 3), 'stage': stage, 'seconds': round(seconds, 6)}
+        event.update({name: value for name, value in fields.items() if value is not None})
+        with self._lock:
+            totals = self.totals[stage]
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            for name, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] += value
+            if self.jsonl_path:
+                with open(self.jsonl_path, mode='a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        # Yields a dict the caller can fill with counts (pages, notices, bytes...) before the stage ends
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            names = sorted({name for totals in self.totals.values() for name in totals})
+            for name in names:
+                metric = f"gazette_stage_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for stage, totals in sorted(self.totals.items()):
+                    if name in totals:
+                        lines.append(f'{metric}{{stage="{stage}"}} {totals[name]:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, mode='w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+
+
+metrics = Metrics()
+
+
+def timed(stage):
+    # Decorator for DatabaseOperations calls; generators are timed until they are exhausted or closed
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                rows = 0
+                try:
+                    for item in fn(*args, **kwargs):
+                        rows += 1
+                        yield item
+                finally:
+                    metrics.record(stage, time.perf_counter() - start, rows=rows)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def synthetic_read_result(pages=3, notices_per_page=4, first_notice=1):
+    # Same shape as the Read v3.2 response consumed by extract_sections
+    read_results = []
+    notice_no = first_notice
+    for page in range(1, pages + 1):
+        lines = [{'text': str(page)}]
+        for _ in range(notices_per_page):
+            lines.append({'text': f'GAZETTE NOTICE NO. {notice_no}'})
+            lines.append({'text': 'THE REGISTERED LAND ACT (Cap. 300, section 35) ISSUE OF A NEW LAND TITLE DEED'})
+            lines.append({'text': f'WHEREAS Jane Doe Number{notice_no}, of P.O. Box {notice_no}, Nakuru in the Republic '
+                                  f'of Kenya, is registered proprietor in absolute ownership interest of that piece of '
+                                  f'land registered under title No. Nakuru/Block 1/{notice_no}, and whereas sufficient '
+                                  f'evidence has been adduced to show that the land title deed issued thereof has been '
+                                  f'lost, notice is given that after the expiration of sixty (60) days from the date '
+                                  f'hereof, I shall issue a new land title deed provided that no objection has been '
+                                  f'received within that period.'})
+            lines.append({'text': 'Dated the 11th January, 2008. S. W. MUCHEMI, Land Registrar, Nakuru District.'})
+            notice_no += 1
+        read_results.append({'page': page, 'lines': lines})
+    return {'status': 'succeeded', 'analyzeResult': {'readResults': read_results}}
+
+
+def synthetic_sections(count=2000, seed=0):
+    # Notice dict in the shape extract_sections hands to save_sections, with varied notice lengths
+    rng = random.Random(seed)
+    words = ('land', 'title', 'deed', 'registered', 'proprietor', 'Nakuru', 'Block', 'P.O.', 'Box', 'hectares',
+             'situate', 'district', 'WHEREAS', 'evidence', 'lost', 'objection', '(Cap.', '300)', 'Kenya', 'Registrar')
+    sections = {}
+    for notice_no in range(1, count + 1):
+        content = ' '.join(rng.choice(words) for _ in range(rng.randint(40, 380)))
+        sections[f'GAZETTE NOTICE NO. {notice_no}'] = {'content': content, 'page_number': str(notice_no // 8 + 1)}
+    return sections
+
+
+def _parse_page_ranges(value):
+    pages = set()
+    for part in value.split(','):
+        start, _, end = part.partition('-')
+        pages.update(range(int(start), int(end or start) + 1))
+    return pages
+
+
+def synthetic_metadata(combined_content):
+    # What the model would answer for the notices in a get_metadata user message
+    items = []
+    for section in combined_content.split('\n\n'):
+        notice = re.search(r"'gazette': '[^']*?(\d+)", section)
+        if notice is None:
+            continue
+        page = re.search(r"'page_number': '?(\d+)", section)
+        notice_no = int(notice.group(1))
+        items.append({
+            'Names': f'Jane Doe Number{notice_no}',
+            'Location': 'Nakuru',
+            'Title No': f'Nakuru/Block 1/{notice_no}',
+            'Notice No': notice_no,
+            'Page No': int(page.group(1)) if page else None
+        })
+    return json.dumps(items)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled clients can reuse connections
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _throttled(self):
+        retry_after = self.server.service.throttle()
+        if retry_after is None:
+            return False
+        self._send(429, json.dumps({'error': {'code': '429', 'message': 'Rate limit exceeded'}}).encode(),
+                   headers={'Retry-After': str(retry_after), 'Content-Type': 'application/json'})
+        return True
+
+
+class _ReadHandler(_Handler):
+    def do_POST(self):
+        service = self.server.service
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(service.latency)
+        if self._throttled():
+            return
+        operation_id = next(service.operation_ids)
+        service.polls[operation_id] = 0
+        pages = parse_qs(urlparse(self.path).query).get('pages')
+        service.requested_pages[operation_id] = _parse_page_ranges(pages[0]) if pages else None
+        location = f'{service.url}/vision/v3.2/read/analyzeResults/{operation_id}'
+        self._send(202, headers={'Operation-Location': location})
+
+    def do_GET(self):
+        service = self.server.service
+        time.sleep(service.latency)
+        if self._throttled():
+            return
+        operation_id = int(self.path.rstrip('/').split('/')[-1])
+        service.polls[operation_id] += 1
+        if service.polls[operation_id] < service.polls_until_done:
+            body = json.dumps({'status': 'running'}).encode()
+        else:
+            result = service.result_factory(operation_id)
+            requested = service.requested_pages[operation_id]
+            if requested is not None:  # Honour the 'pages' parameter like the real service
+                result['analyzeResult']['readResults'] = [
+                    page for page in result['analyzeResult']['readResults'] if page['page'] in requested]
+            body = json.dumps(result).encode()
+        self._send(200, body, headers={'Content-Type': 'application/json'})
+
+
+class _ChatHandler(_Handler):
+    def do_POST(self):
+        service = self.server.service
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(service.latency)
+        if self._throttled():
+            return
+        completion_id = next(service.completion_ids)
+        messages = request.get('messages', [])
+        user_content = messages[-1]['content'] if messages else ''
+        if service.invalid_every and (completion_id + 1) % service.invalid_every == 0:
+            content = 'Sorry, I could not find any land notices.'
+        else:
+            content = service.response_factory(user_content)
+        prompt_tokens = sum(len(message.get('content', '')) // 4 for message in messages)
+        body = json.dumps({
+            'id': f'chatcmpl-{completion_id}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                      'total_tokens': prompt_tokens + len(content) // 4}
+        }).encode()
+        self._send(200, body, headers={'Content-Type': 'application/json'})
+
+
+class _MockService:
+    # Threaded local HTTP server that can answer 429 every Nth request or above a requests-per-minute limit
+    handler = _Handler
+
+    def __init__(self, latency=0.0, throttle_every=0, retry_after=0, requests_per_minute=None):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.request_count = itertools.count(1)
+        self.throttled = 0
+        self._window = deque()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def throttle(self):
+        # Seconds the client should wait, or None if the request is accepted
+        with self._lock:
+            if self.throttle_every and next(self.request_count) % self.throttle_every == 0:
+                self.throttled += 1
+                return self.retry_after
+            if self.requests_per_minute:
+                now = time.monotonic()
+                while self._window and now - self._window[0] >= 60:
+                    self._window.popleft()
+                if len(self._window) >= self.requests_per_minute:
+                    self.throttled += 1
+                    return math.ceil(60 - (now - self._window[0]))
+                self._window.append(now)
+            return None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class MockReadService(_MockService):
+    # Local stand-in for the Azure Read /vision/v3.2/read/analyze endpoint
+    handler = _ReadHandler
+
+    def __init__(self, latency=0.0, polls_until_done=1, throttle_every=0, retry_after=0, result_factory=None,
+                 requests_per_minute=None):
+        super().__init__(latency, throttle_every, retry_after, requests_per_minute)
+        self.polls_until_done = polls_until_done
+        self.result_factory = result_factory or (lambda operation_id: synthetic_read_result())
+        self.operation_ids = itertools.count()
+        self.polls = {}
+        self.requested_pages = {}
+
+
+class MockChatService(_MockService):
+    # Local stand-in for the Azure OpenAI chat completions endpoint; every Nth answer can be made unparseable
+    handler = _ChatHandler
+
+    def __init__(self, latency=0.0, throttle_every=0, retry_after=0, requests_per_minute=None, invalid_every=0,
+                 response_factory=None):
+        super().__init__(latency, throttle_every, retry_after, requests_per_minute)
+        self.invalid_every = invalid_every
+        self.response_factory = response_factory or synthetic_metadata
+        self.completion_ids = itertools.count()
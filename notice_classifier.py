@@ -0,0 +1,59 @@
+import json
+import math
+import re
+
+# Weighted act names and phrases; positive means land related. Notices with no evidence either way score 0.5.
+TERM_WEIGHTS = {
+    'registered land act': 4.0,
+    'land registration act': 4.0,
+    'registration of titles act': 4.0,
+    'government lands act': 4.0,
+    'land titles act': 4.0,
+    'land title deed': 3.0,
+    'certificate of title': 2.5,
+    'certificate of lease': 2.5,
+    'land registrar': 2.0,
+    'registrar of titles': 2.0,
+    'registered proprietor': 2.0,
+    'title no': 1.5,
+    'l.r. no': 1.5,
+    'parcel no': 1.5,
+    'probate and administration': -5.0,
+    'succession cause': -5.0,
+    'letters of administration': -4.0,
+    'estate of the': -2.0,
+    'physical and land use planning act': -5.0,
+    'development plan': -3.0,
+    'companies act': -4.0,
+    'insolvency act': -4.0,
+    'disposal of uncollected goods': -4.0,
+    'change of name': -4.0,
+    'deed poll': -3.0,
+    'high court of kenya': -1.5,
+    "magistrate's court": -1.5,
+}
+TERM_PATTERN = re.compile('|'.join(re.escape(term) for term in sorted(TERM_WEIGHTS, key=len, reverse=True)))
+
+
+def classify_notice(content):
+    # Returns (probability that the notice is land related, matched terms)
+    matched = sorted(set(TERM_PATTERN.findall(content.lower())))
+    score = sum(TERM_WEIGHTS[term] for term in matched)
+    return 1 / (1 + math.exp(-score)), matched
+
+
+class ClassifierAuditLog:
+    # JSON lines record of every notice the classifier kept out of the LLM
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, filename, section_name, section_details, probability, matched):
+        with open(self.path, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'filename': filename,
+                'notice': section_name,
+                'page_number': section_details.get('page_number'),
+                'probability': round(probability, 4),
+                'matched_terms': matched,
+                'excerpt': section_details.get('content', '')[:200],
+            }) + '\n')
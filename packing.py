@@ -0,0 +1,66 @@
+import re
+from collections import namedtuple
+
+PackItem = namedtuple('PackItem', ['index', 'name', 'details', 'tokens'])
+PART_SUFFIX = re.compile(r' \(part \d+ of (\d+)\)$')
+
+
+def part_count(section_name):
+    # Number of parts the notice was split into, None for a notice that was sent whole
+    match = PART_SUFFIX.search(section_name)
+    return int(match.group(1)) if match else None
+
+
+def split_section(section_name, section_details, max_tokens, token_counter, overlap_tokens=50):
+    # Cut an oversized notice into overlapping word windows instead of dropping it
+    words = section_details['content'].split()
+    overhead = token_counter.count(section_name + " (part 00 of 00) " + str({**section_details, 'content': ''}))
+    tokens_per_word = max(token_counter.count(section_details['content']) / max(len(words), 1), 1e-6)
+    chunk_words = max(1, int((max_tokens - overhead) / tokens_per_word))
+    overlap_words = min(int(overlap_tokens / tokens_per_word), chunk_words // 2)
+    step = chunk_words - overlap_words
+
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+
+    return [
+        (f"{section_name} (part {number} of {len(chunks)})", {**section_details, 'content': chunk})
+        for number, chunk in enumerate(chunks, start=1)
+    ]
+
+
+def pack_sections(sections, capacity, token_counter, max_notice_tokens=600, overlap_tokens=50,
+                  output_tokens_per_notice=0, max_output_tokens=None):
+    items = []
+    for section_name, section_details in sections.items():
+        tokens = token_counter.count(section_name + " " + str(section_details))
+        if tokens > max_notice_tokens:
+            parts = split_section(section_name, section_details, max_notice_tokens, token_counter, overlap_tokens)
+            print(f"Section '{section_name}' has {tokens} tokens, splitting it into {len(parts)} parts")
+            for part_name, part_details in parts:
+                part_tokens = token_counter.count(part_name + " " + str(part_details))
+                items.append(PackItem(len(items), part_name, part_details, part_tokens))
+        else:
+            items.append(PackItem(len(items), section_name, section_details, tokens))
+
+    # First-fit decreasing over both the prompt budget and the expected response size
+    bins = []  # [used_tokens, items]
+    for item in sorted(items, key=lambda item: (-item.tokens, item.index)):
+        for bin_ in bins:
+            fits_input = bin_[0] + item.tokens <= capacity
+            fits_output = max_output_tokens is None or \
+                (len(bin_[1]) + 1) * output_tokens_per_notice <= max_output_tokens
+            if fits_input and fits_output:
+                bin_[0] += item.tokens
+                bin_[1].append(item)
+                break
+        else:
+            bins.append([item.tokens, [item]])
+
+    # Keep document order inside and across batches so results are written deterministically
+    batches = [sorted(bin_items, key=lambda item: item.index) for _, bin_items in bins]
+    batches.sort(key=lambda bin_items: bin_items[0].index)
+    return [{item.name: item.details for item in bin_items} for bin_items in batches]
@@ -0,0 +1,59 @@
+class GazettePipeline:
+    # Drives OCR, segmentation, metadata extraction and export over many files. Progress is kept in the
+    # pipeline_documents and pipeline_batches tables, so re-running after a crash picks up where it stopped.
+    def __init__(self, service, output_path=None, max_concurrency=8):
+        self.service = service
+        self.db = service.db
+        self.output_path = output_path
+        self.max_concurrency = max_concurrency
+
+    def run(self, file_paths):
+        documents = {}
+        to_read = []
+        for file_path in file_paths:
+            document = self.db.get_pipeline_document(self.service.document_name(file_path))
+            if document is None or self.service.force_read:
+                # A forced read starts the document over, its status is reset to 'read' below
+                to_read.append(file_path)
+            else:
+                documents[file_path] = (document.full_text_id, document.status)
+        print(f"{len(file_paths) - len(to_read)} of {len(file_paths)} documents already read")
+
+        if to_read:
+            results = self.service.read_documents(to_read, max_concurrency=self.max_concurrency)
+            for file_path, full_text_id in results.items():
+                if full_text_id is None:
+                    continue  # Reported by read_documents, retried on the next run
+                self.db.set_pipeline_document(self.service.document_name(file_path), full_text_id, 'read')
+                documents[file_path] = (full_text_id, 'read')
+            if self.service.ocr_calls_avoided:
+                print(f"{self.service.ocr_calls_avoided} OCR calls avoided for previously read PDFs")
+
+        for file_path in file_paths:
+            if file_path not in documents:
+                continue
+            full_text_id, status = documents[file_path]
+            if status != 'read':
+                continue
+            print(f"Extracting sections from '{file_path}'")
+            try:
+                failed_batches = self.service.extract_sections(full_text_id, checkpoint=True)
+            except Exception as e:
+                print(f"Failed to extract '{file_path}': {e}")
+                continue
+            if failed_batches:
+                print(f"{failed_batches} batches of '{file_path}' failed, they will be retried on the next run")
+                continue
+            self.db.set_pipeline_document(self.service.document_name(file_path), full_text_id, 'extracted')
+            documents[file_path] = (full_text_id, 'extracted')
+
+        extracted = [file_path for file_path in file_paths
+                     if file_path in documents and documents[file_path][1] in ('extracted', 'exported')]
+        if extracted:
+            self.service.export_sections_to_csv([str(documents[file_path][0]) for file_path in extracted],
+                                                output_path=self.output_path)
+            for file_path in extracted:
+                self.db.set_pipeline_document(self.service.document_name(file_path), documents[file_path][0],
+                                              'exported')
+        print(f"{len(extracted)} of {len(file_paths)} documents completed")
+        return {file_path: documents.get(file_path, (None, None))[0] for file_path in file_paths}
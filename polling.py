@@ -0,0 +1,72 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PollTimeoutError(Exception):
+    pass
+
+
+def is_retryable(response):
+    return response.status_code in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(response):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0, factor=2.0):
+    # Exponential backoff with "equal jitter" so concurrent pollers don't line up
+    delay = min(cap, base * (factor ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class OperationPoller:
+    def __init__(self, operation_url, initial_interval=1.0, max_interval=30.0, timeout=600.0):
+        self.operation_url = operation_url
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + timeout
+        self.next_poll_at = self.started_at + initial_interval
+        self.attempt = 0
+        self.polls = 0
+        self.wait_time = initial_interval
+
+    def seconds_until_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.next_poll_at - now)
+
+    def is_due(self, now=None):
+        return self.seconds_until_due(now) == 0.0
+
+    def schedule_next(self, response=None):
+        # Honour Retry-After when the service sends it, otherwise back off exponentially
+        delay = retry_after_seconds(response) if response is not None else None
+        if delay is None:
+            delay = backoff_delay(self.attempt, base=self.initial_interval, cap=self.max_interval)
+        self.attempt += 1
+
+        now = time.monotonic()
+        if now + delay > self.deadline:
+            raise PollTimeoutError(f"Operation {self.operation_url} did not complete within "
+                                   f"{self.deadline - self.started_at:.0f} seconds")
+        self.next_poll_at = now + delay
+        self.wait_time += delay
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
@@ -0,0 +1,40 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    # Sliding one-minute window over requests and tokens, shared by all worker threads
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._calls = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] >= self.window:
+            _, tokens = self._calls.popleft()
+            self._tokens_in_window -= tokens
+
+    def _has_capacity(self, tokens):
+        if not self._calls:  # Always let a request through on an empty window, even if it is over the TPM limit
+            return True
+        if self.requests_per_minute and len(self._calls) >= self.requests_per_minute:
+            return False
+        if self.tokens_per_minute and self._tokens_in_window + tokens > self.tokens_per_minute:
+            return False
+        return True
+
+    def acquire(self, tokens=0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                if self._has_capacity(tokens):
+                    self._calls.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = self.window - (now - self._calls[0][0])
+            time.sleep(max(wait, 0.01))
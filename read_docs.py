@@ -1,17 +1,27 @@
 import uuid
+import hashlib
+import threading
 import json
-import nltk
 import csv
-import requests
+import glob
 import time
+from contextlib import nullcontext
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import os
-import re
-from nltk.tokenize import word_tokenize
-
-nltk.download('punkt')
 from dotenv import load_dotenv
-from db_ops import DatabaseOperations
-from openai import AzureOpenAI
+from db_ops import DatabaseOperations, FullText
+from transport import create_session, create_http_client
+from rate_limit import RateLimiter
+from packing import pack_sections, part_count
+from segmentation import iter_sections, notice_number, notice_hash
+from document_workers import bounded_map, segment_full_text, build_csv_rows, preprocess_name
+from rule_extraction import extract_land_notice
+from notice_classifier import classify_notice, ClassifierAuditLog
+from token_counter import get_token_counter, RegexTokenCounter
+from metrics import metrics as default_metrics
+from text_layer import extract_text_layer, missing_pages, format_page_ranges, merge_read_results
+from polling import OperationPoller, is_retryable, retry_after_seconds, backoff_delay
 
 load_dotenv()
 db_url = os.getenv('DB_URL')
@@ -20,179 +30,700 @@ azure_openai_model = os.getenv('MODEL')
 azure_openai_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
 
 
+class MetadataFormatError(ValueError):
+    pass
+
+
 class AzureReadService:
-    def __init__(self, cognitive_services_key, cognitive_services_endpoint):
+    def __init__(self, cognitive_services_key, cognitive_services_endpoint, poll_timeout=600, request_timeout=60,
+                 max_submit_retries=5, pool_size=10, llm_timeout=120, llm_concurrency=1, requests_per_minute=None,
+                 tokens_per_minute=None, use_cache=True, cache_ttl=30 * 24 * 3600, token_counter='auto',
+                 context_window=16384, max_completion_tokens=12000, max_batch_tokens=2500, output_tokens_per_notice=80,
+                 store_pages=False, pack_window=200, use_rules=True, rule_threshold=0.9,
+                 use_classifier=True, classifier_threshold=0.5, classifier_audit_path='dropped_notices.jsonl',
+                 metrics=default_metrics, use_text_layer=False, force_read=False, incremental=False):
         self.db = DatabaseOperations(db_url)
+        self.metrics = metrics
+        self.use_text_layer = use_text_layer
+        self.force_read = force_read
+        self.incremental = incremental
+        self.ocr_calls_avoided = 0
         self.cognitive_services_key = cognitive_services_key
         self.cognitive_services_endpoint = cognitive_services_endpoint
         self.azure_openai_key = azure_openai_key
         self.azure_openai_model = azure_openai_model
         self.azure_openai_endpoint = azure_openai_endpoint
+        self.poll_timeout = poll_timeout
+        self.request_timeout = request_timeout
+        self.max_submit_retries = max_submit_retries
+        self.poll_stats = {}
+        self.pool_size = pool_size
+        self.llm_timeout = llm_timeout
+        self._session = None
+        self._openai_client = None
+        self._openai_client_lock = threading.Lock()
+        self.llm_concurrency = llm_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.use_cache = use_cache
+        self.cache_ttl = cache_ttl
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        self._cache_stats_lock = threading.Lock()
+        self.token_counter_backend = token_counter
+        self._token_counter = None
+        self._system_prompt_tokens = None
+        self.context_window = context_window
+        self.max_completion_tokens = max_completion_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.output_tokens_per_notice = output_tokens_per_notice
+        self.store_pages = store_pages
+        self.pack_window = pack_window
+        self.use_rules = use_rules
+        self.rule_threshold = rule_threshold
+        self.rule_stats = {'notices': 0, 'bypassed': 0, 'confidence': {}}
+        self.use_classifier = use_classifier
+        self.classifier_threshold = classifier_threshold
+        self.classifier_audit = ClassifierAuditLog(classifier_audit_path) if classifier_audit_path else None
 
     def read_document(self, file_path):
-        headers = {
-            'Ocp-Apim-Subscription-Key': self.cognitive_services_key,
-            'Content-Type': 'application/pdf'
-        }
+        file_name = self.document_name(file_path)
+        content_hash = self.file_hash(file_path)
+        full_text_id = self.find_read_document(content_hash)
+        if full_text_id is not None:
+            print(f'Document already read as {full_text_id}, skipping OCR (use --force to read it again)')
+            return full_text_id
+
+        local_pages = self.read_text_layer(file_path) if self.use_text_layer else None
+        if local_pages is not None and not missing_pages(local_pages):
+            print('Successfully read the document from its text layer')
+            return self.save_local_analysis(file_name, local_pages, content_hash)
+
+        operation_url = self.submit_document(file_path, pages=self.ocr_page_ranges(local_pages))
+        poller = OperationPoller(operation_url, timeout=self.poll_timeout)
+
+        # Polling for the result
+        while True:  # Loop until processing is complete, fails or the deadline passes
+            time.sleep(poller.seconds_until_due())
+            full_text_id = self.poll_operation(poller, file_name, local_pages, content_hash)
+            if full_text_id is not None:
+                break  # Exit the loop if analysis succeeded
+        self.poll_stats[file_path] = {'polls': poller.polls, 'wait_time': poller.wait_time}
+        print(f'Successfully read the document ({poller.polls} polls, {poller.wait_time:.1f}s waiting)')
+        return full_text_id
+
+    def read_documents(self, file_paths, max_concurrency=8):
+        # Submit up to max_concurrency documents at a time and poll every outstanding
+        # Operation-Location from this single loop instead of one blocking loop per file.
+        pending = list(file_paths)
+        in_flight = {}
+        local_pages = {}
+        content_hashes = {}
+        duplicates = {}
+        results = {}
+
+        while pending or in_flight:
+            while pending and len(in_flight) < max_concurrency:
+                file_path = pending.pop(0)
+                try:
+                    content_hash = self.file_hash(file_path)
+                    full_text_id = self.find_read_document(content_hash)
+                    if full_text_id is not None:
+                        print(f"'{file_path}' already read as {full_text_id}, skipping OCR")
+                        results[file_path] = full_text_id
+                        continue
+                    if not self.force_read and content_hash in content_hashes.values():
+                        # Identical copy of a PDF already in this batch, reuse its result once it is read
+                        duplicates[file_path] = next(path for path, h in content_hashes.items() if h == content_hash)
+                        self.ocr_calls_avoided += 1
+                        continue
+                    content_hashes[file_path] = content_hash
+
+                    pages = self.read_text_layer(file_path) if self.use_text_layer else None
+                    if pages is not None and not missing_pages(pages):
+                        results[file_path] = self.save_local_analysis(self.document_name(file_path), pages,
+                                                                      content_hash)
+                        print(f"Successfully read '{file_path}' from its text layer")
+                        continue
+                    operation_url = self.submit_document(file_path, pages=self.ocr_page_ranges(pages))
+                    local_pages[file_path] = pages
+                except Exception as e:
+                    print(f"Failed to submit '{file_path}': {e}")
+                    results[file_path] = None
+                    continue
+                in_flight[file_path] = OperationPoller(operation_url, timeout=self.poll_timeout)
+
+            for file_path, poller in list(in_flight.items()):
+                if not poller.is_due():
+                    continue
+                file_name = self.document_name(file_path)
+                try:
+                    full_text_id = self.poll_operation(poller, file_name, local_pages.get(file_path),
+                                                       content_hashes.get(file_path))
+                except Exception as e:
+                    print(f"Failed to read '{file_path}': {e}")
+                    full_text_id = None
+                else:
+                    if full_text_id is None:
+                        continue
+                    print(f"Successfully read '{file_path}' ({poller.polls} polls, {poller.wait_time:.1f}s waiting)")
+                results[file_path] = full_text_id
+                self.poll_stats[file_path] = {'polls': poller.polls, 'wait_time': poller.wait_time}
+                del in_flight[file_path]
+
+            if in_flight:
+                time.sleep(min(poller.seconds_until_due() for poller in in_flight.values()))
+
+        for file_path, original_path in duplicates.items():
+            results[file_path] = results[original_path]
+        return results
+
+    @staticmethod
+    def file_hash(file_path, chunk_size=1024 * 1024):
+        # Streamed, so hashing a large volume never holds the whole PDF in memory
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def find_read_document(self, content_hash):
+        if self.force_read:
+            return None
+        full_text_id = self.db.get_full_text_id_by_hash(content_hash)
+        if full_text_id is not None:
+            self.ocr_calls_avoided += 1
+        return full_text_id
+
+    def read_text_layer(self, file_path):
+        # None when the PDF has no readable text layer at all, so the whole file goes to Azure Read
+        start = time.perf_counter()
+        try:
+            pages = extract_text_layer(file_path)
+        except Exception as e:
+            print(f"Could not read the text layer of '{file_path}', using Azure Read: {e}")
+            return None
+        local = len(pages) - len(missing_pages(pages))
+        self.metrics.record('read_text_layer', time.perf_counter() - start, document=self.document_name(file_path),
+                            pages=len(pages), local_pages=local)
+        return pages if local else None
+
+    @staticmethod
+    def ocr_page_ranges(local_pages):
+        return format_page_ranges(missing_pages(local_pages)) if local_pages is not None else None
+
+    def save_local_analysis(self, file_name, read_results, content_hash=None):
+        analysis = {'status': 'succeeded', 'analyzeResult': {'version': 'text-layer', 'readResults': read_results}}
+        return self.save_analysis(file_name, analysis, content_hash=content_hash)
+
+    def save_analysis(self, file_name, analysis, raw_text=None, content_hash=None):
+        if self.store_pages:
+            # Pages go to their own JSONB rows, the raw text blob is not kept
+            return self.db.insert_full_text(uuid.uuid4(), None, str(file_name),
+                                            pages=analysis['analyzeResult']['readResults'], content_hash=content_hash)
+        return self.db.insert_full_text(uuid.uuid4(), raw_text or json.dumps(analysis), str(file_name),
+                                        content_hash=content_hash)
+
+    def submit_document(self, file_path, pages=None):
+        headers = {'Content-Type': 'application/pdf'}
         params = {'readingOrder': 'natural'}
+        if pages:  # Only OCR these pages, e.g. "3,7-9"
+            params['pages'] = pages
+        start = time.perf_counter()
+        # The file object is streamed as the request body rather than read into memory
         with open(file_path, 'rb') as f:
-            data = f.read()
-        response = requests.post(
-            self.cognitive_services_endpoint + '/vision/v3.2/read/analyze',
-            headers=headers,
-            params=params,
-            data=data
-        )
+            for attempt in range(self.max_submit_retries + 1):
+                f.seek(0)
+                response = self.session.post(
+                    self.cognitive_services_endpoint + '/vision/v3.2/read/analyze',
+                    headers=headers,
+                    params=params,
+                    data=f,
+                    timeout=self.request_timeout
+                )
+                if not is_retryable(response) or attempt == self.max_submit_retries:
+                    break
+                delay = retry_after_seconds(response)
+                time.sleep(delay if delay is not None else backoff_delay(attempt))
+        self.metrics.record('submit_document', time.perf_counter() - start, document=self.document_name(file_path),
+                            bytes=os.path.getsize(file_path), attempts=attempt + 1)
         response.raise_for_status()
-        operation_url = response.headers['Operation-Location']
+        return response.headers['Operation-Location']
+
+    def poll_operation(self, poller, file_name, local_pages=None, content_hash=None):
+        # Returns the full_text_id once the analysis succeeded, None while it is still running
+        response = self.session.get(poller.operation_url, timeout=self.request_timeout)
+        poller.polls += 1
+        if is_retryable(response):  # Throttled or transient server error, try again later
+            poller.schedule_next(response)
+            return None
+        response.raise_for_status()  # Check the HTTP status code
+        analysis = response.json()
+
+        # Check the analysis status
+        if 'status' in analysis:
+            if analysis['status'] == 'succeeded':
+                self.metrics.record('read_document', poller.elapsed, document=str(file_name),
+                                    bytes=len(response.content), pages=len(analysis['analyzeResult']['readResults']),
+                                    polls=poller.polls, wait_seconds=poller.wait_time)
+                if local_pages is not None:  # Only the pages without a text layer were sent for OCR
+                    analysis['analyzeResult']['readResults'] = merge_read_results(
+                        local_pages, analysis['analyzeResult']['readResults'])
+                    return self.save_analysis(file_name, analysis, content_hash=content_hash)
+                return self.save_analysis(file_name, analysis, raw_text=str(response.text), content_hash=content_hash)
+            elif analysis['status'] == 'failed':
+                raise Exception("Read document analysis failed")
+        # If status is running or notStarted, continue polling
+        poller.schedule_next(response)
+        return None
 
-        file_name = os.path.basename(file_path).rstrip('.pdf')
+    @staticmethod
+    def document_name(file_path):
+        return os.path.basename(file_path).rstrip('.pdf')
 
-        # Polling for the result
-        analysis = None
-        while True:  # Loop indefinitely until we break out when processing is complete or fails
-            response = requests.get(operation_url, headers={'Ocp-Apim-Subscription-Key': self.cognitive_services_key})
-            response.raise_for_status()  # Check the HTTP status code
-            analysis = response.json()
-
-            # Check the analysis status
-            if 'status' in analysis:
-                if analysis['status'] == 'succeeded':
-                    full_text_id = self.db.insert_full_text(uuid.uuid4(), str(response.text), str(file_name))
-                    break  # Exit the loop if analysis succeeded
-                elif analysis['status'] == 'failed':
-                    raise Exception("Read document analysis failed")
-                # If status is running or notStarted, continue polling
-            time.sleep(1)
-        print('Successfully read the document')
-        return full_text_id
+    @staticmethod
+    def resolve_document_paths(path):
+        # Accepts a directory (all PDFs inside it) or a glob pattern
+        if os.path.isdir(path):
+            return sorted(glob.glob(os.path.join(path, '*.pdf')))
+        return sorted(glob.glob(path))
 
-    def extract_sections(self, full_text_id):
-        sections = {}
-        current_section = ""
-        current_page_number = ""
+    def extract_sections(self, full_text_id, checkpoint=False):
         full_text = self.db.get_full_text_by_id(full_text_id)
-        analysis_result = json.loads(full_text.content)
-        for page_num, page in enumerate(analysis_result['analyzeResult']['readResults'], start=1):
-            for line in page['lines'][:3]:  # Check the first three lines
-                text = line['text']
-                if text.isdigit():  # Check if the text is a digit
-                    current_page_number = text
-                    break  # Stop checking once a page number is found
-            for line in page['lines']:
-                text = line['text']
-                if "GAZETTE NOTICE NO." in text:
-                    if current_section:  # Add text before "GAZETTE NOTICE NO." to the current section
-                        pre_notice_text = text.split("GAZETTE NOTICE NO.")[0].strip()
-                        sections[current_section]["content"] += pre_notice_text + " "
-                    notice_title = "GAZETTE NOTICE NO." + text.split("GAZETTE NOTICE NO.")[1].split(":")[0].strip()
-                    current_section = notice_title
-                    sections[current_section] = {"content": "", "page_number": current_page_number}
-                    post_notice_text = text.split("GAZETTE NOTICE NO.")[1].split(":", 1)[
-                        1].strip() if ":" in text else ""
-                    sections[current_section]["content"] += post_notice_text + " "
-                elif current_section:  # Only add text if we are within a section
-                    sections[current_section]["content"] += text + " "
-
-        if current_section and "Price: KSh" in sections[current_section]["content"]:
-            price_index = sections[current_section]["content"].find("Price: KSh")
-            sections[current_section]["content"] = sections[current_section]["content"][:price_index].strip()
-
-        self.save_sections(full_text, full_text_id, sections)
+        sections = iter_sections(self.iter_read_results(full_text))
+
+        failed_batches = self.save_sections(full_text, full_text_id, sections, checkpoint=checkpoint)
         print('Sections saved successfully')
+        if self.use_cache:
+            print(f"LLM cache: {self.cache_stats['hits']} hits, {self.cache_stats['misses']} misses")
+        return failed_batches
+
+    def extract_documents(self, full_text_ids, workers=None, checkpoint=False):
+        # JSON parsing and segmentation run in a process pool, one document per task, while the LLM calls
+        # and DB writes for finished documents happen here. Returns failed batch counts per document.
+        results = {}
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for full_text_id, name, sections in bounded_map(pool, segment_full_text, full_text_ids,
+                                                            prefetch=workers * 2):
+                full_text = FullText(id=full_text_id, name=name)  # save_sections only needs the name
+                print(f"Saving {len(sections)} sections of '{full_text.name}'")
+                results[full_text_id] = self.save_sections(full_text, full_text_id, sections, checkpoint=checkpoint)
+        return results
+
+    def iter_read_results(self, full_text):
+        if full_text.content is None:  # Stored page by page, see store_pages
+            return self.db.iter_full_text_pages(full_text.id)
+        return json.loads(full_text.content)['analyzeResult']['readResults']
+
+    def save_sections(self, full_text, full_text_id, sections, checkpoint=False):
+        # With checkpoint each batch is saved together with a record that it completed, and batches recorded
+        # by an earlier, interrupted run are skipped. Otherwise the whole document is written in one transaction.
+        with self.metrics.stage('extract_sections', document=full_text.name, notices=0, batches=0, rows=0) as stage:
+            rows = []
+            notice_hashes = {}
+            split_notices = {}
+            deferred_batches = []
+            non_land_notices = []
+            failed_batches = 0
+            self.rule_stats = {'notices': 0, 'bypassed': 0, 'confidence': {}}
+            sections = self.count_notices(sections, stage)
+            sections = self.select_changed_sections(full_text, sections, notice_hashes, stage)
+            if self.use_classifier:
+                sections = self.classify_sections(full_text, sections)
+            if self.use_rules:
+                sections = self.pre_extract_sections(full_text, full_text_id, sections, rows, notice_hashes)
+            section_batches = self.iter_section_batches(sections)
+            if checkpoint:
+                completed = self.db.get_completed_batch_keys(full_text_id)
+                section_batches = (batch for batch in section_batches if self.batch_key(batch) not in completed)
+
+            for index, (batch, metadata_list) in enumerate(self.get_batch_metadata(section_batches)):
+                stage['batches'] += 1
+                part_numbers = self.count_parts(batch, split_notices)
+                if metadata_list is None:
+                    failed_batches += 1
+                    self.fail_parts(part_numbers, split_notices)
+                    continue  # The batch failed, the error was reported when it was collected
+                try:
+                    batch_rows, declined = self.metadata_rows(full_text, full_text_id, metadata_list, notice_hashes)
+                except MetadataFormatError as e:
+                    print(f"Batch {index} returned unusable metadata, skipping it: {e}")
+                    failed_batches += 1
+                    self.fail_parts(part_numbers, split_notices)
+                    continue
+                answered = self.non_land_notices(full_text, batch, batch_rows, declined, part_numbers,
+                                                 split_notices, notice_hashes)
+                batch_rows = self.collect_part_rows(batch_rows, part_numbers, split_notices)
+                if checkpoint:
+                    # A batch holding part of a split notice is only checkpointed once the merged row is written
+                    deferred_batches.append((self.batch_key(batch), part_numbers))
+                    batch_keys = [key for key, numbers in deferred_batches
+                                  if self.parts_state(numbers, split_notices) == 'written']
+                    deferred_batches = [(key, numbers) for key, numbers in deferred_batches
+                                        if self.parts_state(numbers, split_notices) == 'pending']
+                    self.db.insert_section_texts(batch_rows, full_text_id=full_text_id, batch_keys=batch_keys,
+                                                 non_land_notices=answered)
+                    stage['rows'] += len(batch_rows)
+                else:
+                    rows.extend(batch_rows)
+                    non_land_notices.extend(answered)
+
+            # Write every section of the document in one transaction
+            self.db.insert_section_texts(rows, non_land_notices=non_land_notices)
+            stage['rows'] += len(rows)
+            stage['failed_batches'] = failed_batches
+        if self.use_cache and self.cache_ttl is not None:
+            # Expired responses are never served again, drop them so the table doesn't grow with every run
+            evicted = self.db.delete_llm_responses(older_than=self.cache_ttl)
+            if evicted:
+                print(f"LLM cache: evicted {evicted} expired responses")
+        if self.use_rules and self.rule_stats['notices']:
+            print(f"Rule extraction: {self.rule_stats['bypassed']}/{self.rule_stats['notices']} notices of "
+                  f"'{full_text.name}' ({self.rule_stats['bypassed'] / self.rule_stats['notices']:.1%}) "
+                  f"bypassed the LLM")
+        return failed_batches
 
-    def save_sections(self, full_text, full_text_id, sections):
-        section_batches = self.batch_sections_by_tokens(sections)
-
-        for batch in section_batches:
-            metadata_list = self.get_metadata([
-                {'gazette': section_name, 'content': section_details}
-                for section_name, section_details in batch.items()
-            ])
-            if isinstance(metadata_list, str):
-                data = json.loads(metadata_list)
-
-                if isinstance(data, list):
-                    for item in data:
-                        if 'Response' in item and item['Response']:
-                            # Handle the response
-                            continue
-                        else:
-                            # Extract each item
-                            names = item.get('Names')
-                            location = item.get('Location')
-                            title_no = item.get('Title No')
-                            page_no = item.get('Page No')
-                            notice_no = item.get('Notice No')
-                            self.db.insert_section_text(
-                                full_text_id,
-                                "content",
-                                full_text.name,
-                                page_no,
-                                notice_no,
-                                [names],
-                                [title_no],
-                                location)
+    @staticmethod
+    def count_parts(batch, split_notices):
+        # Tracks how many parts of each split notice are still unanswered, returns the notices with parts here
+        numbers = set()
+        for section_name in batch:
+            total = part_count(section_name)
+            if total is None:
+                continue
+            number = notice_number(section_name)
+            notice = split_notices.setdefault(number, {'remaining': total, 'rows': [], 'failed': False,
+                                                      'declined': True})
+            notice['remaining'] -= 1
+            numbers.add(number)
+        return numbers
 
     @staticmethod
-    def batch_sections_by_tokens(sections, max_tokens=2500):
-        section_batches = []
-        current_batch = {}
-        current_tokens = 0
-
-        for section_name, section_details in sections.items():
-            # Estimate the number of tokens for the current section
-            tokens = word_tokenize(section_name + " " + str(section_details))
-            section_tokens = len(tokens)
-
-            if section_tokens > 600:
-                print(f"Warning: Section '{section_name}' exceeds the max token limit of 600.Skipping this "
-                      f"section.")
+    def fail_parts(numbers, split_notices):
+        # A notice with a failed part is not written, so the whole notice is extracted again on the next run
+        for number in numbers:
+            split_notices[number]['failed'] = True
+            split_notices[number]['rows'] = []
+
+    @staticmethod
+    def parts_state(numbers, split_notices):
+        if any(split_notices[number]['failed'] for number in numbers):
+            return 'failed'
+        if all(split_notices[number]['remaining'] == 0 for number in numbers):
+            return 'written'
+        return 'pending'
+
+    @staticmethod
+    def non_land_notices(full_text, batch, batch_rows, declined, part_numbers, split_notices, notice_hashes):
+        # Notices that got no row from a batch that answered {"Response": "None"}. A batch that simply left
+        # notices out says nothing about them, so they are extracted again on the next run. A split notice
+        # counts once all of its parts are answered and every one of those batches declined.
+        if not declined:
+            for number in part_numbers:
+                split_notices[number]['declined'] = False
+            return []
+        numbers = {notice_number(section_name) for section_name in batch if part_count(section_name) is None}
+        numbers |= {number for number in part_numbers if split_notices[number]['remaining'] == 0 and
+                    not split_notices[number]['failed'] and not split_notices[number]['rows'] and
+                    split_notices[number]['declined']}
+        numbers -= {row['gazette_notice_number'] for row in batch_rows}
+        return [
+            {'filename': full_text.name, 'gazette_notice_number': number, 'content_hash': notice_hashes.get(number)}
+            for number in sorted(numbers) if number is not None
+        ]
+
+    @classmethod
+    def collect_part_rows(cls, batch_rows, numbers, split_notices):
+        # Every part of a split notice comes back under the same notice number. Its rows are held back
+        # until all parts are answered and then written as one merged row.
+        rows = []
+        for row in batch_rows:
+            if row['gazette_notice_number'] in numbers:
+                split_notices[row['gazette_notice_number']]['rows'].append(row)
+            else:
+                rows.append(row)
+        for number in numbers:
+            notice = split_notices[number]
+            if notice['remaining'] == 0 and not notice['failed'] and notice['rows']:
+                rows.append(cls.merge_part_rows(notice['rows']))
+        return rows
+
+    @staticmethod
+    def merge_part_rows(part_rows):
+        merged = dict(part_rows[0])
+        for column in ('name_of_holder', 'registration_number'):
+            values = []
+            for row in part_rows:
+                values.extend(value for value in row[column] or [] if value and value not in values)
+            merged[column] = values or merged[column]
+        for column in ('location', 'page_number'):
+            merged[column] = next((row[column] for row in part_rows if row[column]), merged[column])
+        return merged
+
+    @staticmethod
+    def count_notices(sections, stage):
+        sections = sections.items() if isinstance(sections, dict) else sections
+        for section in sections:
+            stage['notices'] += 1
+            yield section
+
+    def select_changed_sections(self, full_text, sections, notice_hashes, stage):
+        # Records the hash of every notice for its rows. In incremental mode notices already extracted from
+        # the same text, into a row or answered as not land related, are skipped. Only new or changed notices,
+        # and those whose batch failed or returned invalid JSON, are extracted again.
+        sections = sections.items() if isinstance(sections, dict) else sections
+        stored = self.db.get_section_hashes(full_text.name) if self.incremental else {}
+        skipped = 0
+        for section_name, section_details in sections:
+            number = notice_number(section_name)
+            notice_hashes[number] = notice_hash(section_details)
+            if number is not None and notice_hashes[number] in stored.get(number, ()):
+                skipped += 1
+                continue
+            yield section_name, section_details
+        if self.incremental:
+            stage['unchanged'] = skipped
+            print(f"Incremental extraction: {skipped} unchanged notices skipped")
+
+    def classify_sections(self, full_text, sections):
+        # Drop notices that are clearly not land related before they cost an LLM call
+        sections = sections.items() if isinstance(sections, dict) else sections
+        dropped = 0
+        for section_name, section_details in sections:
+            probability, matched = classify_notice(section_details.get('content', ''))
+            if probability >= self.classifier_threshold:
+                yield section_name, section_details
                 continue
+            dropped += 1
+            if self.classifier_audit is not None:
+                self.classifier_audit.record(full_text.name, section_name, section_details, probability, matched)
+        print(f"Classifier dropped {dropped} non-land notices")
+
+    def pre_extract_sections(self, full_text, full_text_id, sections, rows, notice_hashes=None):
+        # Template-conforming land notices are extracted with rules; only the leftovers are yielded for the LLM
+        sections = sections.items() if isinstance(sections, dict) else sections
+        for section_name, section_details in sections:
+            item, confidence = extract_land_notice(section_name, section_details)
+            self.rule_stats['notices'] += 1
+            self.rule_stats['confidence'][section_name] = confidence
+            bypassed = item is not None and confidence >= self.rule_threshold
+            self.metrics.record('rule_extraction', document=full_text.name, notice=section_name,
+                                confidence=round(confidence, 3), bypassed=bypassed)
+            if bypassed:
+                self.rule_stats['bypassed'] += 1
+                rows.append(self.metadata_row(full_text, full_text_id, item, notice_hashes))
+            else:
+                yield section_name, section_details
+
+    def iter_section_batches(self, sections):
+        # Pack notices a window at a time, so batches reach the LLM while later pages are still being segmented
+        sections = iter(sections.items() if isinstance(sections, dict) else sections)
+        while True:
+            window = dict(islice(sections, self.pack_window))
+            if not window:
+                break
+            with self.metrics.stage('batch_sections_by_tokens', notices=len(window)) as stage:
+                batches = self.batch_sections_by_tokens(
+                    window,
+                    max_tokens=self.batch_token_budget,
+                    token_counter=self.token_counter,
+                    output_tokens_per_notice=self.output_tokens_per_notice,
+                    max_output_tokens=self.max_completion_tokens
+                )
+                stage['batches'] = len(batches)
+            yield from batches
+
+    def get_batch_metadata(self, section_batches):
+        # Dispatch batches to the LLM in parallel but yield the responses in batch order, so rows are
+        # written deterministically and earlier batches are saved while later ones are still running.
+        # Batches are only pulled from the generator as results are consumed, two per worker at most.
+        def fetch(batch):
+            try:
+                return batch, self.get_metadata(self.batch_payload(batch)), None
+            except Exception as e:
+                return batch, None, e
+
+        with ThreadPoolExecutor(max_workers=self.llm_concurrency) as executor:
+            results = bounded_map(executor, fetch, section_batches, prefetch=self.llm_concurrency * 2)
+            for index, (batch, metadata, error) in enumerate(results):
+                if error is not None:
+                    print(f"Failed to get metadata for batch {index}: {error}")
+                yield batch, metadata
+
+    @staticmethod
+    def batch_payload(batch):
+        return [
+            {'gazette': section_name, 'content': section_details}
+            for section_name, section_details in batch.items()
+        ]
 
-            # Check if adding this section would exceed the max token limit
-            if current_tokens + section_tokens > max_tokens:
-                # If it would, start a new batch
-                section_batches.append(current_batch)
-                current_batch = {section_name: section_details}
-                current_tokens = section_tokens
+    @staticmethod
+    def combined_content(sections):
+        return "\n\n".join([str(section) for section in sections])
+
+    def batch_key(self, batch):
+        return self.metadata_cache_key(self.combined_content(self.batch_payload(batch)))
+
+    @classmethod
+    def metadata_rows(cls, full_text, full_text_id, metadata_list, notice_hashes=None):
+        rows = []
+        declined = False
+        try:
+            data = json.loads(metadata_list)
+        except (TypeError, json.JSONDecodeError) as e:
+            raise MetadataFormatError(f"invalid JSON: {e}") from e
+        if not isinstance(data, list):
+            raise MetadataFormatError(f"expected a list of notices, got {type(data).__name__}")
+        if not all(isinstance(item, dict) for item in data):
+            raise MetadataFormatError("expected every notice to be an object")
+
+        for item in data:
+            if 'Response' in item and item['Response']:
+                # The model answered that a notice is not land related
+                declined = True
             else:
-                # Add the section to the current batch
-                current_batch[section_name] = section_details
-                current_tokens += section_tokens
+                rows.append(cls.metadata_row(full_text, full_text_id, item, notice_hashes))
+        return rows, declined
 
-        # Add the last batch if it's not empty
-        if current_batch:
-            section_batches.append(current_batch)
+    @staticmethod
+    def metadata_row(full_text, full_text_id, item, notice_hashes=None):
+        # Extract each item
+        gazette_notice_number = str(item['Notice No']) if item.get('Notice No') is not None else None
+        return {
+            'full_text_id': full_text_id,
+            'section_content': "content",
+            'filename': full_text.name,
+            'page_number': item.get('Page No'),
+            'gazette_notice_number': gazette_notice_number,
+            'name_of_holder': AzureReadService.split_values(item.get('Names')),
+            'registration_number': AzureReadService.split_values(item.get('Title No')),
+            'location': item.get('Location'),
+            'content_hash': (notice_hashes or {}).get(gazette_notice_number)
+        }
 
-        return section_batches
+    @staticmethod
+    def split_values(value):
+        # The LLM comma-separates several holders or title numbers; each becomes its own array element so
+        # the GIN indexes can match a single one
+        if not isinstance(value, str):
+            return [value]
+        values = [part.strip() for part in value.split(',') if part.strip()]
+        return values or [value]
 
-    def get_metadata(self, sections):
-        client = AzureOpenAI(
-            api_key=self.azure_openai_key,
-            api_version="2023-08-01-preview",
-            azure_endpoint=self.azure_openai_endpoint
+    @staticmethod
+    def batch_sections_by_tokens(sections, max_tokens=2500, token_counter=None, max_notice_tokens=600,
+                                 overlap_tokens=50, output_tokens_per_notice=0, max_output_tokens=None):
+        token_counter = token_counter or RegexTokenCounter()
+        return pack_sections(
+            sections,
+            capacity=max_tokens,
+            token_counter=token_counter,
+            max_notice_tokens=min(max_notice_tokens, max_tokens),
+            overlap_tokens=overlap_tokens,
+            output_tokens_per_notice=output_tokens_per_notice,
+            max_output_tokens=max_output_tokens
         )
 
+    @property
+    def batch_token_budget(self):
+        # Whatever the context window has left after the system prompt and the reserved completion tokens
+        available = self.context_window - self.max_completion_tokens - self.system_prompt_tokens
+        return max(1, min(self.max_batch_tokens, available))
+
+    @property
+    def session(self):
+        # Created on first use, so commands that never call Azure Read don't pay for it
+        if self._session is None:
+            self._session = create_session(self.pool_size,
+                                           headers={'Ocp-Apim-Subscription-Key': self.cognitive_services_key})
+        return self._session
+
+    @property
+    def token_counter(self):
+        if self._token_counter is None:
+            self._token_counter = get_token_counter(self.token_counter_backend, self.azure_openai_model)
+        return self._token_counter
+
+    @property
+    def openai_client(self):
+        # Built once and reused for every batch, on top of the shared connection pool. The openai package is
+        # only imported here, the first time metadata is requested.
+        with self._openai_client_lock:  # Worker threads may ask for it at the same time
+            if self._openai_client is None:
+                from openai import AzureOpenAI
+                self._openai_client = AzureOpenAI(
+                    api_key=self.azure_openai_key,
+                    api_version="2023-08-01-preview",
+                    azure_endpoint=self.azure_openai_endpoint,
+                    http_client=create_http_client(self.pool_size, timeout=self.llm_timeout)
+                )
+        return self._openai_client
+
+    def metadata_cache_key(self, combined_content):
+        # Identical model, prompt and batch content always produce the same key
+        digest = hashlib.sha256()
+        for part in (self.azure_openai_model, self.system_prompt(), combined_content):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _count_cache(self, outcome):
+        with self._cache_stats_lock:
+            self.cache_stats[outcome] += 1
+
+    def get_metadata(self, sections):
+        start = time.perf_counter()
         messages = [{"role": "system", "content": self.system_prompt()}]
-        combined_content = "\n\n".join([str(section) for section in sections])
+        combined_content = self.combined_content(sections)
         messages.append({"role": "user", "content": combined_content})
 
-        tokens = word_tokenize(self.system_prompt() + " " + str(combined_content))
-        total_tokens = len(tokens)
-        print(total_tokens)
+        cache_key = self.metadata_cache_key(combined_content)
+        if self.use_cache:
+            cached = self.db.get_llm_response(cache_key, self.cache_ttl)
+            if cached is not None:
+                self._count_cache('hits')
+                self.metrics.record('get_metadata', time.perf_counter() - start, notices=len(sections), cache_hits=1)
+                return cached
+            self._count_cache('misses')
+
+        client = self.openai_client
+
+        total_tokens = self.system_prompt_tokens + self.token_counter.count(combined_content)
+        self.rate_limiter.acquire(total_tokens)
 
         response = client.chat.completions.create(
             model=self.azure_openai_model,
             messages=messages,
             temperature=0,
-            max_tokens=12000,
+            max_tokens=self.max_completion_tokens,
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0
         )
 
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        usage = getattr(response, 'usage', None)
+        self.metrics.record('get_metadata', time.perf_counter() - start, notices=len(sections),
+                            estimated_tokens=total_tokens,
+                            prompt_tokens=getattr(usage, 'prompt_tokens', None),
+                            completion_tokens=getattr(usage, 'completion_tokens', None))
+        if self.use_cache and self._is_json(content):  # Don't pin unusable responses in the cache
+            self.db.insert_llm_response(cache_key, self.azure_openai_model, content)
+        return content
+
+    @property
+    def system_prompt_tokens(self):
+        # The prompt never changes for a given counter, so count it once
+        if self._system_prompt_tokens is None:
+            self._system_prompt_tokens = self.token_counter.count(self.system_prompt())
+        return self._system_prompt_tokens
+
+    @staticmethod
+    def _is_json(content):
+        try:
+            json.loads(content)
+        except (TypeError, ValueError):
+            return False
+        return True
 
     @staticmethod
     def system_prompt():
@@ -342,29 +873,14 @@ class AzureReadService:
             """
         return prompt
 
-    @staticmethod
-    def preprocess_name(name):
-        try:
-            name = str(name)
-            # Convert to lowercase and remove extra whitespaces
-            name = re.sub(r'\s+', '', name.lower().strip())
-
-            # Handle names separated by comma
-            if ',' in name:
-                names = name.split(',')
-                names = [re.sub(r'[^a-zA-Z0-9\s/]', '', n) for n in names]
-                return ','.join(names)
-
-            # Remove special characters
-            name = re.sub(r'[^a-zA-Z0-9\s/]', '', name)
-            return name
-        except:
-            return name
-
-    def export_sections_to_csv(self, doc_ids):
+    preprocess_name = staticmethod(preprocess_name)
+
+    def export_sections_to_csv(self, doc_ids, output_path=None, workers=1, chunk_size=2000):
+        start = time.perf_counter()
         # Open a new CSV file to write to
-        home = os.path.expanduser("~")
-        download_path = os.path.join(home, 'Downloads', 'sections_export.csv')
+        if output_path is None:
+            home = os.path.expanduser("~")
+            output_path = os.path.join(home, 'Downloads', 'sections_export.csv')
         sample_submission_path = "sample_submission.csv"
 
         with open(sample_submission_path, mode='r', newline='', encoding='utf-8') as sample_file:
@@ -372,47 +888,32 @@ class AzureReadService:
             next(sample_reader)  # Skip the header
             sample_ids = {rows[0] for rows in sample_reader}  # Store in a set for O(1) look-ups
 
-        with open(download_path, mode='w', newline='', encoding='utf-8') as file:
+        with open(output_path, mode='w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
 
             # Write the header row
             writer.writerow(['id', 'pred'])
+            # Only sample ids are remembered, so memory stays bounded by the sample rather than the corpus
             exported_ids = set()
-
-            # Loop through each full_text_id and process its sections
-            for doc_id in doc_ids:
-                # Query the database for all sections with the current full_text_id
-                sections = self.db.get_sections_by_doc_id(doc_id)
-
-                for section in sections:
-                    filename = section.filename
-                    if '2022_VOL252' in filename:
-                        filename = filename.replace('VOL252', '252')
-
-                    if section.name_of_holder:
-                        holder_names = ', '.join(section.name_of_holder).encode('utf-8').decode('utf-8')
-                        id_holder = f"{filename}_{section.gazette_notice_number}_name of the holder"
-                        writer.writerow([id_holder, self.preprocess_name(holder_names)])
-
-                    if section.registration_number:
-                        reg_numbers = ', '.join(section.registration_number).encode('utf-8').decode('utf-8')
-                        id_reg = f"{filename}_{section.gazette_notice_number}_Registration numbers"
-                        writer.writerow([id_reg, self.preprocess_name(reg_numbers)])
-
-                    if section.location:
-                        location = ', '.join(section.location).encode('utf-8').decode('utf-8') if isinstance(section.location, (list, tuple)) else section.location
-                        id_location = f"{filename}_{section.gazette_notice_number}_Land location"
-                        writer.writerow([id_location, self.preprocess_name(location)])
-
-                    if section.name_of_holder:
-                        exported_ids.add(f"{filename}_{section.gazette_notice_number}_name of the holder")
-                    if section.registration_number:
-                        exported_ids.add(f"{filename}_{section.gazette_notice_number}_Registration numbers")
-                    if section.location:
-                        exported_ids.add(f"{filename}_{section.gazette_notice_number}_Land location")
-
-            for sample_id in sample_ids:
-                if sample_id not in exported_ids:
-                    writer.writerow([sample_id, 'none'])
-
-
+            rows_written = 0
+
+            # A single streamed query covers every requested document; rows are built in chunks,
+            # across a process pool when workers > 1
+            section_rows = self.db.iter_section_rows(doc_ids)
+            section_chunks = iter(lambda: [tuple(row) for row in islice(section_rows, chunk_size)], [])
+            with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as pool:
+                if pool:
+                    csv_chunks = bounded_map(pool, build_csv_rows, section_chunks, prefetch=workers * 2)
+                else:
+                    csv_chunks = map(build_csv_rows, section_chunks)
+                for csv_rows in csv_chunks:
+                    writer.writerows(csv_rows)
+                    rows_written += len(csv_rows)
+                    exported_ids.update(row_id for row_id, _ in csv_rows if row_id in sample_ids)
+
+            for sample_id in sorted(sample_ids - exported_ids):
+                writer.writerow([sample_id, 'none'])
+                rows_written += 1
+        self.metrics.record('export_sections_to_csv', time.perf_counter() - start, documents=len(doc_ids),
+                            rows=rows_written, bytes=os.path.getsize(output_path))
+        print(f'Exported sections to {output_path}')
@@ -0,0 +1,76 @@
+import re
+
+TEMPLATE_MARKERS = ('REGISTERED LAND ACT', 'LAND TITLE DEED', 'WHEREAS', 'REGISTRAR')
+NOTICE_NUMBER = re.compile(r'(\d+)')
+PROPRIETORS = re.compile(r'WHEREAS\s+(.+?),?\s+(?:both\s+|all\s+)?of\s+(?:P\.\s?O\.|Post)', re.IGNORECASE | re.DOTALL)
+ID_NUMBER = re.compile(r'\(\s*ID[^)]*\)', re.IGNORECASE)
+LIST_NUMBER = re.compile(r'\(\s*\d+\s*\)')
+TITLE_NUMBER = re.compile(r'\b(?:title|L\.?R\.?|parcel)\s+(?:No\.?|number)\s*(.+?),?\s+and\s+whereas', re.IGNORECASE | re.DOTALL)
+DISTRICT = re.compile(r'situate\s+in\s+the\s+(district\s+of\s+[A-Z][\w\' -]*?)\s*,', re.IGNORECASE)
+LAND_REGISTRAR = re.compile(r'Land\s+Registrar,\s+([A-Z][\w\' -]*?)(?:\s+District)?\s*[.,]', re.IGNORECASE)
+POSTAL_ADDRESS = re.compile(r'\bP\.?\s?O\b', re.IGNORECASE)
+# Lowercase words that are part of a name rather than prose like 'the administrator of'
+NAME_PARTICLES = {'arap', 'wa', 'bin', 'binti', 'ole'}
+
+
+def normalize_page_number(page_number):
+    # OCR sometimes reads the running header twice, e.g. '518518217', '19141914' or '1151151'.
+    # A single digit repeat is not trusted and neither is more than one possible length, e.g. '12121212',
+    # those notices are left to the LLM.
+    page_number = str(page_number or '').strip()
+    if not page_number.isdigit():
+        return None
+    if len(page_number) <= 4:
+        return int(page_number)
+    sizes = [size for size in range(2, 5) if page_number[size:2 * size] == page_number[:size]]
+    if len(sizes) != 1:
+        return None
+    return int(page_number[:sizes[0]])
+
+
+def split_names(text):
+    text = LIST_NUMBER.sub(' ', ID_NUMBER.sub(' ', text))
+    names = re.split(r',|\band\b', text)
+    return [' '.join(name.split()) for name in names if name.strip()]
+
+
+def plausible_names(names):
+    # Every word of every name is capitalised, with no digits or postal address swallowed from the notice
+    for name in names:
+        if any(char.isdigit() for char in name) or POSTAL_ADDRESS.search(name):
+            return False
+        if any(not word[0].isupper() and word not in NAME_PARTICLES for word in name.split()):
+            return False
+    return bool(names)
+
+
+def extract_land_notice(section_name, section_details):
+    # Returns (item in the same shape as the LLM response, confidence between 0 and 1)
+    content = section_details.get('content', '')
+    upper = content.upper()
+    if not all(marker in upper for marker in TEMPLATE_MARKERS) or upper.count('WHEREAS') != 2:
+        return None, 0.0  # Not the standard template, or several notices merged together
+
+    notice = NOTICE_NUMBER.search(section_name)
+    proprietors = PROPRIETORS.search(content)
+    title = TITLE_NUMBER.search(content)
+    district = DISTRICT.search(content)
+    registrar = LAND_REGISTRAR.search(content)
+    page_number = normalize_page_number(section_details.get('page_number'))
+
+    names = split_names(proprietors.group(1)) if proprietors else []
+    item = {
+        'Names': ', '.join(names) or None,
+        'Location': district.group(1) if district else (registrar.group(1) if registrar else None),
+        'Title No': ' '.join(title.group(1).split()) if title else None,
+        'Notice No': int(notice.group(1)) if notice else None,
+        'Page No': page_number,
+    }
+    confidence = sum(1 for value in item.values() if value) / len(item)
+    if item['Names'] and len(item['Names']) > 120:  # Swallowed more than a list of names
+        confidence -= 0.5
+    if item['Names'] and not plausible_names(names):  # e.g. 'the administrator of the estate of ...'
+        confidence -= 0.5
+    if not district and registrar:  # Footer location is a fallback, the LLM may do better
+        confidence -= 0.05
+    return item, max(confidence, 0.0)
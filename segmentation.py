@@ -0,0 +1,59 @@
+import hashlib
+import re
+
+# "GAZETTE NOTICE NO. 43", "GAZETTE NOTICE No 43:" ... Headings are printed in capitals, so in-text references
+# like "revokes Gazette Notice No. 1234" or "GAZETTE NOTICE NO. 12 of 2007" do not start a notice.
+NOTICE_HEADING = re.compile(r'GAZETTE\s+NOTICE\s+N[Oo]\.?\s*(\d+)\b(?!\s+of\s+\d{4})\s*:?')
+PRICE_MARKER = "Price: KSh"
+
+
+def page_number_of(page):
+    for line in page['lines'][:3]:  # Check the first three lines
+        if line['text'].isdigit():
+            return line['text']
+    return None
+
+
+def iter_sections(read_results):
+    # Yields (notice title, {'content', 'page_number'}) one notice at a time while scanning the pages once
+    current_title = None
+    current_page_number = ""
+    section_page_number = ""
+    buffer = []
+
+    for page in read_results:
+        current_page_number = page_number_of(page) or current_page_number
+        for line in page['lines']:
+            text = line['text']
+            position = 0
+            for match in NOTICE_HEADING.finditer(text):
+                if current_title is not None:  # Text before the heading still belongs to the previous notice
+                    buffer.append(text[position:match.start()].strip())
+                    yield current_title, {'content': _join(buffer), 'page_number': section_page_number}
+                current_title = "GAZETTE NOTICE NO." + match.group(1)
+                section_page_number = current_page_number
+                buffer = []
+                position = match.end()
+            if current_title is not None:  # Only add text if we are within a section
+                buffer.append(text[position:].strip())
+
+    if current_title is not None:
+        content = _join(buffer)
+        if PRICE_MARKER in content:  # The last notice runs into the back cover
+            content = content[:content.find(PRICE_MARKER)].strip()
+        yield current_title, {'content': content, 'page_number': section_page_number}
+
+
+def notice_number(section_name):
+    match = re.search(r'\d+', section_name)
+    return str(int(match.group())) if match else None
+
+
+def notice_hash(section_details):
+    # Whitespace is normalized so re-reading a document with different line breaks keeps the same hash
+    text = ' '.join(str(section_details.get('content', '')).split())
+    return hashlib.sha256(f"{text}\0{section_details.get('page_number')}".encode('utf-8')).hexdigest()
+
+
+def _join(buffer):
+    return ' '.join(part for part in buffer if part)
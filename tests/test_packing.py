@@ -0,0 +1,28 @@
+from packing import pack_sections, part_count
+from token_counter import RegexTokenCounter
+
+
+def test_oversized_notice_is_split_into_ordered_parts():
+    long_content = ' '.join(f'word{index}' for index in range(300))
+    sections = {
+        'GAZETTE NOTICE NO.1': {'content': 'short notice', 'page_number': '14'},
+        'GAZETTE NOTICE NO.2': {'content': long_content, 'page_number': '14'},
+        'GAZETTE NOTICE NO.3': {'content': 'another short notice', 'page_number': '15'},
+    }
+
+    batches = pack_sections(sections, capacity=400, token_counter=RegexTokenCounter(), max_notice_tokens=200,
+                            overlap_tokens=20)
+
+    names = [name for batch in batches for name in batch]
+    parts = [name for name in names if name.startswith('GAZETTE NOTICE NO.2 ')]
+    assert names[0] == 'GAZETTE NOTICE NO.1' and names[-1] == 'GAZETTE NOTICE NO.3'
+    assert len(parts) > 1
+    assert parts == [f'GAZETTE NOTICE NO.2 (part {number} of {len(parts)})' for number in range(1, len(parts) + 1)]
+    assert all(part_count(name) == len(parts) for name in parts)
+    assert part_count('GAZETTE NOTICE NO.1') is None
+
+    words = set()
+    for batch in batches:
+        for name in parts:
+            words.update(batch.get(name, {'content': ''})['content'].split())
+    assert words == set(long_content.split())
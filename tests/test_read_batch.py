@@ -0,0 +1,85 @@
+import functools
+import threading
+import uuid
+
+import read_docs
+from mock_services import MockReadService
+from polling import OperationPoller
+
+
+class InMemoryDatabase:
+    def __init__(self, database_url=None):
+        self.full_texts = {}
+
+    def get_full_text_id_by_hash(self, content_hash):
+        return None
+
+    def insert_full_text(self, doc_id, content, name, pages=None, content_hash=None):
+        self.full_texts[doc_id] = name
+        return doc_id
+
+
+def make_service(monkeypatch, url):
+    monkeypatch.setattr(read_docs, 'DatabaseOperations', InMemoryDatabase)
+    monkeypatch.setattr(read_docs, 'OperationPoller', functools.partial(OperationPoller, initial_interval=0.05))
+    return read_docs.AzureReadService('key', url, classifier_audit_path=None)
+
+
+def write_pdfs(directory, count):
+    paths = []
+    for index in range(count):
+        path = directory / f'gazette-{index}.pdf'
+        path.write_bytes(b'%PDF-1.4\n' + uuid.uuid4().bytes)
+        paths.append(str(path))
+    return paths
+
+
+def test_read_documents_bounds_concurrency_and_polls_from_one_loop(monkeypatch, tmp_path):
+    with MockReadService(polls_until_done=3) as service:
+        azure_read_service = make_service(monkeypatch, service.url)
+        in_flight = set()
+        max_in_flight = 0
+        polling_threads = set()
+
+        submit_document = azure_read_service.submit_document
+        poll_operation = azure_read_service.poll_operation
+
+        def tracking_submit(file_path, pages=None):
+            nonlocal max_in_flight
+            operation_url = submit_document(file_path, pages=pages)
+            in_flight.add(operation_url)
+            max_in_flight = max(max_in_flight, len(in_flight))
+            return operation_url
+
+        def tracking_poll(poller, *args, **kwargs):
+            polling_threads.add(threading.get_ident())
+            full_text_id = poll_operation(poller, *args, **kwargs)
+            if full_text_id is not None:
+                in_flight.discard(poller.operation_url)
+            return full_text_id
+
+        monkeypatch.setattr(azure_read_service, 'submit_document', tracking_submit)
+        monkeypatch.setattr(azure_read_service, 'poll_operation', tracking_poll)
+
+        file_paths = write_pdfs(tmp_path, 7)
+        results = azure_read_service.read_documents(file_paths, max_concurrency=3)
+
+    assert max_in_flight == 3
+    assert polling_threads == {threading.get_ident()}
+    assert all(service.polls[operation_id] == 3 for operation_id in service.polls)
+    assert set(results) == set(file_paths)
+    assert len(set(results.values())) == len(file_paths)
+    for file_path, full_text_id in results.items():
+        assert azure_read_service.db.full_texts[full_text_id] == azure_read_service.document_name(file_path)
+
+
+def test_read_documents_maps_failed_document_to_none(monkeypatch, tmp_path):
+    with MockReadService() as service:
+        azure_read_service = make_service(monkeypatch, service.url)
+        file_paths = write_pdfs(tmp_path, 2)
+        missing_path = str(tmp_path / 'missing.pdf')
+        results = azure_read_service.read_documents(file_paths + [missing_path], max_concurrency=2)
+
+    assert results[missing_path] is None
+    assert all(results[file_path] is not None for file_path in file_paths)
+    assert len(service.polls) == 2
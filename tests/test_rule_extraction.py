@@ -0,0 +1,49 @@
+import pytest
+
+from rule_extraction import extract_land_notice, normalize_page_number
+
+
+@pytest.mark.parametrize('page_number, expected', [
+    ('14', 14),
+    ('1914', 1914),
+    ('518518217', 518),
+    ('516516217', 516),
+    ('522522217', 522),
+    ('19141914', 1914),
+    ('114114217', 114),
+    ('1151151', 115),
+    ('22422417', 224),
+    ('11211', None),
+    ('12121212', None),
+    ('77217', None),
+    ('', None),
+    ('14a', None),
+])
+def test_normalize_page_number(page_number, expected):
+    assert normalize_page_number(page_number) == expected
+
+
+def test_ambiguous_page_number_sends_notice_to_llm():
+    content = ('THE REGISTERED LAND ACT (Cap. 300, section 35) ISSUE OF A NEW LAND TITLE DEED WHEREAS Jane Doe, '
+               'of P.O. Box 1, Nakuru in the Republic of Kenya, is registered proprietor of that piece of land '
+               'situate in the district of Nakuru, registered under title No. Nakuru/Block 1/1, and whereas '
+               'sufficient evidence has been adduced to show that the land title deed has been lost. '
+               'S. W. MUCHEMI, Land Registrar, Nakuru District.')
+    item, confidence = extract_land_notice('GAZETTE NOTICE NO.1', {'content': content, 'page_number': '11211'})
+    assert item['Page No'] is None
+    assert confidence < 0.9
+
+    item, confidence = extract_land_notice('GAZETTE NOTICE NO.1', {'content': content, 'page_number': '114114217'})
+    assert item['Page No'] == 114
+    assert confidence == 1.0
+
+
+def test_implausible_names_send_notice_to_llm():
+    content = ('THE REGISTERED LAND ACT (Cap. 300, section 35) ISSUE OF A NEW LAND TITLE DEED WHEREAS Hassan Ali '
+               'Mohamed, the administrator of the estate of Ali Mohamed, of P.O. Box 1, Nakuru in the Republic of '
+               'Kenya, is registered proprietor of that piece of land situate in the district of Nakuru, registered '
+               'under title No. Nakuru/Block 1/1, and whereas sufficient evidence has been adduced to show that the '
+               'land title deed has been lost. S. W. MUCHEMI, Land Registrar, Nakuru District.')
+    item, confidence = extract_land_notice('GAZETTE NOTICE NO.1', {'content': content, 'page_number': '14'})
+    assert item['Names'] == 'Hassan Ali Mohamed, the administrator of the estate of Ali Mohamed'
+    assert confidence < 0.9
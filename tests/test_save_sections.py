@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+import read_docs
+from segmentation import notice_number
+
+
+class FullText:
+    name = 'gazette.pdf'
+
+
+class RecordingDatabase:
+    def __init__(self, database_url=None):
+        self.writes = []
+
+    def get_completed_batch_keys(self, full_text_id):
+        return set()
+
+    def insert_section_texts(self, rows, full_text_id=None, batch_keys=None, non_land_notices=None):
+        self.writes.append({'rows': rows, 'batch_keys': batch_keys, 'non_land_notices': non_land_notices})
+
+
+def answer(names):
+    # One row per section, named after the section so merged parts can be told apart
+    def get_metadata(sections):
+        return json.dumps([
+            {'Names': names[section['gazette']], 'Location': 'Nakuru', 'Title No': 'Nakuru/Block 1/1',
+             'Notice No': int(notice_number(section['gazette'])), 'Page No': 14}
+            for section in sections
+        ])
+    return get_metadata
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(read_docs, 'DatabaseOperations', RecordingDatabase)
+    return read_docs.AzureReadService('key', 'http://localhost', use_cache=False, use_rules=False,
+                                      use_classifier=False, classifier_audit_path=None, token_counter='regex')
+
+
+def save_batches(service, monkeypatch, batches, get_metadata):
+    monkeypatch.setattr(service, 'iter_section_batches', lambda sections: iter(batches))
+    monkeypatch.setattr(service, 'get_metadata', get_metadata)
+    sections = {name: details for batch in batches for name, details in batch.items()}
+    return service.save_sections(FullText(), 'doc-1', sections, checkpoint=True)
+
+
+def test_split_notice_is_merged_and_checkpointed_once_complete(service, monkeypatch):
+    details = {'content': 'WHEREAS ...', 'page_number': '14'}
+    batches = [
+        {'GAZETTE NOTICE NO.1': details, 'GAZETTE NOTICE NO.2 (part 1 of 2)': details},
+        {'GAZETTE NOTICE NO.2 (part 2 of 2)': details},
+    ]
+    names = {'GAZETTE NOTICE NO.1': 'Jane Doe', 'GAZETTE NOTICE NO.2 (part 1 of 2)': 'John Doe',
+             'GAZETTE NOTICE NO.2 (part 2 of 2)': 'John Doe, Mary Doe'}
+
+    assert save_batches(service, monkeypatch, batches, answer(names)) == 0
+
+    first, second = service.db.writes[:2]
+    assert [row['gazette_notice_number'] for row in first['rows']] == ['1']
+    assert first['batch_keys'] == []  # Waits for the rest of notice 2
+    assert [row['gazette_notice_number'] for row in second['rows']] == ['2']
+    assert second['rows'][0]['name_of_holder'] == ['John Doe', 'Mary Doe']
+    assert second['batch_keys'] == [service.batch_key(batch) for batch in batches]
+
+
+def test_failed_part_keeps_every_batch_of_the_notice_unchecked(service, monkeypatch):
+    details = {'content': 'WHEREAS ...', 'page_number': '14'}
+    batches = [
+        {'GAZETTE NOTICE NO.1': details, 'GAZETTE NOTICE NO.2 (part 1 of 2)': details},
+        {'GAZETTE NOTICE NO.2 (part 2 of 2)': details},
+    ]
+    names = {'GAZETTE NOTICE NO.1': 'Jane Doe', 'GAZETTE NOTICE NO.2 (part 1 of 2)': 'John Doe'}
+    get_metadata = answer(names)
+
+    def failing_get_metadata(sections):
+        if any('part 2' in section['gazette'] for section in sections):
+            raise RuntimeError('timeout')
+        return get_metadata(sections)
+
+    assert save_batches(service, monkeypatch, batches, failing_get_metadata) == 1
+
+    written = [row['gazette_notice_number'] for write in service.db.writes for row in write['rows']]
+    assert written == ['1']
+    assert all(not write['batch_keys'] for write in service.db.writes)
+
+
+def test_declined_notices_are_recorded_as_non_land(service, monkeypatch):
+    details = {'content': 'IN THE HIGH COURT ...', 'page_number': '14'}
+    batches = [
+        {'GAZETTE NOTICE NO.1': details, 'GAZETTE NOTICE NO.2': details},
+        {'GAZETTE NOTICE NO.3': details},
+        {'GAZETTE NOTICE NO.4': details},
+    ]
+    responses = iter([
+        json.dumps([{'Names': 'Jane Doe', 'Location': 'Nakuru', 'Title No': 'Nakuru/Block 1/1', 'Notice No': 1,
+                     'Page No': 14}, {'Response': 'None'}]),
+        json.dumps([]),  # Says nothing about notice 3
+        json.dumps({'Response': 'None'}),  # Not a list, the batch failed
+    ])
+
+    assert save_batches(service, monkeypatch, batches, lambda sections: next(responses)) == 1
+
+    rows = [row['gazette_notice_number'] for write in service.db.writes for row in write['rows']]
+    non_land = [notice['gazette_notice_number'] for write in service.db.writes
+                for notice in write['non_land_notices'] or []]
+    assert rows == ['1']
+    assert non_land == ['2']
@@ -0,0 +1,28 @@
+from segmentation import iter_sections, notice_number
+
+
+def page(number, *lines):
+    return {'lines': [{'text': number}] + [{'text': line} for line in lines]}
+
+
+def test_in_text_references_do_not_start_a_notice():
+    read_results = [
+        page('14',
+             'GAZETTE NOTICE NO. 43',
+             'This revokes Gazette Notice No. 1234 of the Land Registrar.',
+             'GAZETTE NOTICE NO. 12 of 2007 is also cancelled.',
+             'GAZETTE NOTICE No 44: WHEREAS Jane Doe'),
+        page('15', 'of P.O. Box 1, Nakuru GAZETTE NOTICE NO.45 THE REGISTERED LAND ACT'),
+    ]
+
+    sections = list(iter_sections(read_results))
+
+    assert [name for name, _ in sections] == ['GAZETTE NOTICE NO.43', 'GAZETTE NOTICE NO.44', 'GAZETTE NOTICE NO.45']
+    assert sections[0][1] == {
+        'content': 'This revokes Gazette Notice No. 1234 of the Land Registrar. '
+                   'GAZETTE NOTICE NO. 12 of 2007 is also cancelled.',
+        'page_number': '14',
+    }
+    assert sections[1][1] == {'content': 'WHEREAS Jane Doe 15 of P.O. Box 1, Nakuru', 'page_number': '14'}
+    assert sections[2][1] == {'content': 'THE REGISTERED LAND ACT', 'page_number': '15'}
+    assert [notice_number(name) for name, _ in sections] == ['43', '44', '45']
@@ -0,0 +1,62 @@
+POINTS_PER_INCH = 72.0
+
+
+def extract_text_layer(file_path, min_chars=20):
+    # Reads the embedded text of a born-digital PDF into the Read API readResults shape. Pages with less
+    # than min_chars of text (scans, images) are returned as None so only they need to go through OCR.
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer, LTTextLine
+
+    pages = []
+    for page_number, layout in enumerate(extract_pages(file_path), start=1):
+        height = layout.height
+        lines = []
+        for element in layout:
+            if not isinstance(element, LTTextContainer):
+                continue
+            for text_line in element:
+                if not isinstance(text_line, LTTextLine):
+                    continue
+                text = ' '.join(text_line.get_text().split())
+                if not text:
+                    continue
+                # Same clockwise boundingBox as the Read API, in inches from the top-left corner
+                x0, y0, x1, y1 = (round(value / POINTS_PER_INCH, 4) for value in (
+                    text_line.x0, height - text_line.y1, text_line.x1, height - text_line.y0))
+                lines.append({'boundingBox': [x0, y0, x1, y0, x1, y1, x0, y1], 'text': text})
+
+        if sum(len(line['text']) for line in lines) < min_chars:
+            pages.append(None)
+            continue
+        pages.append({
+            'page': page_number,
+            'angle': 0,
+            'width': round(layout.width / POINTS_PER_INCH, 4),
+            'height': round(height / POINTS_PER_INCH, 4),
+            'unit': 'inch',
+            'lines': lines
+        })
+    return pages
+
+
+def missing_pages(pages):
+    return [page_number for page_number, page in enumerate(pages, start=1) if page is None]
+
+
+def format_page_ranges(page_numbers):
+    # [1, 2, 3, 7] -> "1-3,7", the format of the Read API 'pages' parameter
+    ranges = []
+    for page_number in sorted(page_numbers):
+        if ranges and page_number == ranges[-1][1] + 1:
+            ranges[-1][1] = page_number
+        else:
+            ranges.append([page_number, page_number])
+    return ','.join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+
+def merge_read_results(local_pages, ocr_pages):
+    # Fill the pages without a text layer with the OCR results, matched on their 'page' number
+    pages = list(local_pages)
+    for ocr_page in ocr_pages:
+        pages[ocr_page['page'] - 1] = ocr_page
+    return [page for page in pages if page is not None]
@@ -0,0 +1,80 @@
+import os
+import re
+import hashlib
+import tempfile
+
+# Roughly what nltk's word_tokenize produces: runs of word characters and single punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+TIKTOKEN_BLOB_URL = 'https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken'
+
+
+class RegexTokenCounter:
+    name = 'regex'
+
+    def count(self, text):
+        return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+
+class NltkTokenCounter:
+    name = 'nltk'
+
+    def __init__(self):
+        import nltk
+        from nltk.tokenize import word_tokenize
+        # Only use tokenizer data that is already installed; fetch it once with `python -m nltk.downloader punkt`
+        nltk.data.find('tokenizers/punkt')
+        self._word_tokenize = word_tokenize
+
+    def count(self, text):
+        return len(self._word_tokenize(text))
+
+
+class TiktokenCounter:
+    name = 'tiktoken'
+
+    def __init__(self, model=None):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(self.encoding_name(model))
+
+    @staticmethod
+    def encoding_name(model=None):
+        import tiktoken.model
+        try:
+            return tiktoken.model.encoding_name_for_model(model) if model else 'cl100k_base'
+        except KeyError:  # Azure deployment names are not always model names
+            return 'cl100k_base'
+
+    @classmethod
+    def is_cached(cls, model=None):
+        # Mirrors tiktoken's own cache lookup, so 'auto' never downloads an encoding on a worker
+        cache_dir = os.environ.get('TIKTOKEN_CACHE_DIR', os.environ.get('DATA_GYM_CACHE_DIR'))
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'data-gym-cache')
+        if not cache_dir:
+            return False
+        url = TIKTOKEN_BLOB_URL.format(cls.encoding_name(model))
+        return os.path.exists(os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()))
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def get_token_counter(backend='auto', model=None):
+    # 'auto' uses the model's BPE tokenizer when tiktoken and its encoding are already cached, else the regex
+    # estimate; 'tiktoken' may download the encoding
+    if backend == 'regex':
+        return RegexTokenCounter()
+    if backend == 'nltk':
+        return NltkTokenCounter()
+    if backend not in ('auto', 'tiktoken'):
+        raise ValueError(f"Unknown token counter backend '{backend}'")
+    try:
+        if backend == 'auto' and not TiktokenCounter.is_cached(model):
+            print("tiktoken encoding is not cached, estimating tokens with a regex")
+            return RegexTokenCounter()
+        return TiktokenCounter(model)
+    except Exception as e:
+        if backend == 'tiktoken':
+            raise
+        print(f"tiktoken is not available ({type(e).__name__}), estimating tokens with a regex")
+        return RegexTokenCounter()
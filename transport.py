@@ -0,0 +1,22 @@
+def create_session(pool_size=10, headers=None):
+    # A single keep-alive session so OCR submission and polling reuse TCP/TLS connections
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def create_http_client(pool_size=10, timeout=120):
+    # httpx client handed to AzureOpenAI so every chat completion shares the same connection pool
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=timeout
+    )